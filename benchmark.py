@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tracemalloc
+import multiprocessing
+import numpy as np
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from processing.operations import Operation, decode_signal, decode_signals, get_aggregation
+from processing.processing_pipeline import AccelerometerSignalProcessingPipeline, GeneralASPP
+from processing.signal_store import SignalStore
+from util.data_set import SIGNAL_COLUMN
+from util.synthetic_data import make_zeb_data_set, make_windshield_data_set
+from util.score import (
+    score_grade_capabilities, score_inter_setup_deviation, score_inter_setup_deviation_raw, FeatureScorer
+)
+
+
+BENCHMARK_OPERATIONS = ["avg-5", "rmp-5", "bnd-10/40", "bnd-00/10"]
+BENCHMARK_AGGREGATIONS = ["RMS", "STD", "P10", "P90", "MAX", "MOM", "MFFT"]
+PAPER_ASPPS = [([], "RMS"), (["avg-5"], "STD"), (["avg-3", "avg-3"], "RMS")]
+
+# the core must stay importable with numpy and scipy only, e.g. for workers starting an interpreter per job
+CORE_MODULES = ["processing.operations", "processing.processing_pipeline", "processing.realtime"]
+HEAVY_MODULES = ["pandas", "sklearn", "tqdm", "multiprocessing", "matplotlib", "seaborn"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measures the throughput of processing, scoring and I/O")
+    parser.add_argument("--segments", type=int, default=100, help="segments per setup of the ZEB like data set")
+    parser.add_argument("--windshield_rows", type=int, default=50, help="rows per note of the windshield data set")
+    parser.add_argument("--min_length", type=int, default=100, help="minimum number of samples per segment")
+    parser.add_argument("--max_length", type=int, default=400, help="maximum number of samples per segment")
+    parser.add_argument("--max_complexity", type=int, default=2)
+    parser.add_argument("--processes", type=int, default=None, help="worker processes of GeneralASPP")
+    parser.add_argument("--repeat", type=int, default=3, help="the fastest of repeat runs is reported")
+    parser.add_argument("--output", default="./results/benchmark.json")
+    parser.add_argument("--compare", default="", help="json file of an earlier run to compare with")
+    parser.add_argument("--imports_only", action="store_true", help="only check the import time of the core")
+    return parser.parse_args()
+
+
+def report_worker_memory(function, queue):
+    function()
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    queue.put(peak / 1e6 if sys.platform == "darwin" else peak / 1e3)
+
+
+def measure_worker_memory(function):
+    """
+    runs function once in a forked process, since the peak memory of the children is a maximum over all children
+    since the start of a process, e.g. including the interpreters of check_core_imports
+    :return: largest peak resident memory of one worker process of function in MB, None if unknown
+    """
+    if resource is None or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=report_worker_memory, args=(function, queue))
+    process.start()
+    peak = queue.get()
+    process.join()
+    return peak if peak > 0 else None
+
+
+def measure(function, repeat):
+    """
+    tracemalloc only sees the memory of this process, the memory of worker processes is measured by
+    measure_worker_memory
+    :return: fastest wall time of repeat calls in seconds and the peak traced memory of one more call in MB
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(seconds), peak / 1e6
+
+
+class Benchmark:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, function, rows, pipelines=None, workers=False):
+        """
+        :param pipelines: number of pipelines computed by function, pipelines_per_second is None if not given
+        :param workers: function starts worker processes, their peak memory is measured with one more call
+        """
+        seconds, peak_memory = measure(function, self.repeat)
+        result = {
+            "name": name,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds,
+            "pipelines_per_second": None if pipelines is None else pipelines / seconds,
+            "peak_memory_mb": peak_memory,
+            "worker_peak_memory_mb": measure_worker_memory(function) if workers else None,
+        }
+        print("[INFO] {:<40} {:>10.4f}s {:>12.0f} rows/s {:>10} pipelines/s {:>8.1f} MB {:>8} MB workers".format(
+            name, seconds, result["rows_per_second"],
+            "-" if pipelines is None else "{:.1f}".format(result["pipelines_per_second"]), peak_memory,
+            "-" if result["worker_peak_memory_mb"] is None else "{:.1f}".format(result["worker_peak_memory_mb"])))
+        self.results.append(result)
+
+
+def measure_import(module, repeat):
+    """
+    imports module in fresh interpreters
+    :return: fastest import time in seconds and the heavy modules loaded by the import
+    """
+    code = "import sys, time; t = time.perf_counter(); import {}; print(time.perf_counter() - t); " \
+           "print(','.join([m for m in {!r} if m in sys.modules]))".format(module, HEAVY_MODULES)
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__))).decode().split("\n")
+        seconds.append(float(output[0]))
+    return min(seconds), [m for m in output[1].split(",") if m]
+
+
+def check_core_imports(benchmark):
+    """
+    records the import time of the core modules and fails if one of them loads a heavy dependency
+    """
+    failed = {}
+    for module in CORE_MODULES:
+        seconds, heavy = measure_import(module, benchmark.repeat)
+        print("[INFO] {:<40} {:>10.4f}s {}".format("import " + module, seconds, ",".join(heavy)))
+        benchmark.results.append({"name": "import " + module, "seconds": seconds, "heavy_modules": heavy})
+        if len(heavy) > 0:
+            failed[module] = heavy
+    if len(failed) > 0:
+        raise RuntimeError("Core modules import heavy dependencies: {}".format(failed))
+
+
+def check_feature_scorer(df, aspp_ids, tolerance=1e-6):
+    """
+    fails if the scores of FeatureScorer differ from score_grade_capabilities and score_inter_setup_deviation
+    """
+    scores = FeatureScorer(df).score(df[aspp_ids].to_numpy(), aspp_ids)
+    reference = {
+        "grading": [score_grade_capabilities(df, f) for f in aspp_ids],
+        "consistency": [score_inter_setup_deviation(df, f) for f in aspp_ids],
+    }
+    for key, values in reference.items():
+        if not np.allclose(scores[key], values, rtol=0, atol=tolerance, equal_nan=True):
+            error = np.nanmax(np.abs(np.asarray(scores[key]) - np.asarray(values)))
+            raise RuntimeError("FeatureScorer {} differs from the reference by {}".format(key, error))
+    print("[INFO] FeatureScorer matches the reference scores of {} ASPPs".format(len(aspp_ids)))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, file_name):
+    with open(file_name) as f:
+        previous = {r["name"]: r for r in json.load(f)["results"]}
+    print("[INFO] Speedup compared to {}".format(file_name))
+    for r in results:
+        if r["name"] in previous:
+            print("[INFO] {:<40} {:>6.2f}x".format(r["name"], previous[r["name"]]["seconds"] / r["seconds"]))
+
+
+def main(args):
+    benchmark = Benchmark(args.repeat)
+    check_core_imports(benchmark)
+    if args.imports_only:
+        return
+
+    zeb_df = make_zeb_data_set(args.segments, min_length=args.min_length, max_length=args.max_length)
+    windshield_df = make_windshield_data_set(
+        args.windshield_rows, min_length=args.min_length, max_length=args.max_length)
+    encoded = zeb_df[SIGNAL_COLUMN].tolist()
+    signals = SignalStore.from_df(zeb_df, SIGNAL_COLUMN)
+    rows = len(signals)
+    print("[INFO] {} ZEB rows, {} windshield rows, {} samples".format(rows, len(windshield_df), len(signals.values)))
+
+    records = [{SIGNAL_COLUMN: s} for s in encoded if isinstance(s, str)]
+    benchmark.run("decode_signal", lambda: [decode_signal(row) for row in records], len(records))
+    benchmark.run("decode_signals", lambda: decode_signals(encoded), rows)
+
+    for op_id in BENCHMARK_OPERATIONS:
+        op = Operation(op_id)
+        benchmark.run("operation {}".format(op_id), lambda: [op.compute(s) for s in signals], rows)
+    for aggregation_id in BENCHMARK_AGGREGATIONS:
+        aggregation = get_aggregation(aggregation_id)
+        benchmark.run("aggregation {}".format(aggregation_id), lambda: [aggregation(s) for s in signals], rows)
+
+    for operation_ids, aggregation_id in PAPER_ASPPS:
+        aspp = AccelerometerSignalProcessingPipeline(operation_ids, aggregation_id)
+        benchmark.run("compute_df {}".format(aspp), lambda: aspp.compute_df(signals), rows)
+        benchmark.run("compute_batch {}".format(aspp), lambda: aspp.compute_batch(signals), rows)
+
+    features = {}
+    for complexity in range(args.max_complexity + 1):
+        g_aspp = GeneralASPP(BENCHMARK_OPERATIONS, BENCHMARK_AGGREGATIONS, complexity=complexity)
+        benchmark.run(
+            "GeneralASPP-{}".format(complexity),
+            lambda: features.update(g_aspp.compute_df(signals, share_prefixes=True, processes=args.processes)),
+            rows * len(g_aspp), len(g_aspp), workers=True
+        )
+
+    feature_df = zeb_df.drop(columns=[SIGNAL_COLUMN])
+    for aspp_id in list(features)[:len(BENCHMARK_AGGREGATIONS)]:
+        feature_df[aspp_id] = features[aspp_id]
+    aspp_ids = list(features)[:len(BENCHMARK_AGGREGATIONS)]
+    benchmark.run(
+        "score_grade_capabilities",
+        lambda: [score_grade_capabilities(feature_df, f) for f in aspp_ids], rows * len(aspp_ids), len(aspp_ids))
+    benchmark.run(
+        "score_inter_setup_deviation",
+        lambda: [score_inter_setup_deviation(feature_df, f) for f in aspp_ids], rows * len(aspp_ids), len(aspp_ids))
+    check_feature_scorer(feature_df, aspp_ids)
+    matrix = np.column_stack([features[aspp_id] for aspp_id in features])
+    scorer = FeatureScorer(feature_df)
+    benchmark.run(
+        "FeatureScorer.score", lambda: scorer.score(matrix, list(features)), rows * len(features), len(features))
+
+    windshield_signals = SignalStore.from_df(windshield_df, SIGNAL_COLUMN)
+    aspp = AccelerometerSignalProcessingPipeline([], "RMS")
+    windshield_df[str(aspp)] = aspp.compute_df(windshield_signals)
+    benchmark.run(
+        "score_inter_setup_deviation_raw",
+        lambda: score_inter_setup_deviation_raw(windshield_df, str(aspp)), len(windshield_df))
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output, "w") as f:
+        json.dump({"commit": git_commit(), "config": vars(args), "results": benchmark.results}, f, indent=2)
+    print("[INFO] Results written to {}".format(args.output))
+    if args.compare:
+        compare(benchmark.results, args.compare)
+
+
+if __name__ == "__main__":
+    main(parse_args())
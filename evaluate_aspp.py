@@ -1,13 +1,37 @@
 import os
+import hashlib
+import argparse
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import numpy as np
 
-from processing.processing_pipeline import GeneralASPP
-from util.article_plots import plots_for_papers, plot_feature
+from processing.processing_pipeline import AccelerometerSignalProcessingPipeline, GeneralASPP, compute_aspp_matrix
+from processing.feature_cache import FeatureCache, FEATURE_VERSION
+from processing.search import SuccessiveHalvingSearch, BeamSearch
+from processing.chunked import compute_chunked
+from processing.feature_matrix import FeatureMatrix
+from processing import profiling
+from processing.sharding import select_shard, grid_fingerprint, save_shard, merge_shards
+from util.data_set import load_data_set, iterate_data_set
 from util.path import check_n_make_dir
-from util.score import score_inter_setup_deviation, score_grade_capabilities
+from util.score import FeatureScorer, SCORE_VERSION
+
+
+# Define the Parameter Spaces
+LIST_OF_OPERATIONS = [
+    "avg-3", "avg-5", "avg-7", "avg-9", "avg-11",
+    "rmp-3", "rmp-5", "rmp-7", "rmp-9", "rmp-11",
+    "bnd-00/25", "bnd-10/40", "bnd-25/50",
+    "bnd-00/10", "bnd-10/20", "bnd-20/30", "bnd-30/40", "bnd-40/50",
+]
+
+LIST_OF_AGGREGATIONS = ["RMS", "STD", "MAX", "MOM", "MFFT"]
+
+# ASPPs shown in the paper figures, computed in addition to the grid if it does not contain them
+PAPER_ASPPS = [([], "RMS"), (["avg-5"], "STD"), (["avg-3", "avg-3"], "RMS")]
+
+# Metadata needed to score features and to generate plots
+META_COLUMNS = [
+    "gtr - grade", "ZWAUN_15", "AUN", "setup", "car", "phone", "segment_id", "source", "vel [km/h]", "vel [km/h] (r)"
+]
 
 
 def digitize_grade(df):
@@ -25,80 +49,233 @@ def digitize_grade(df):
     return df
 
 
-def score_aspp(df, aspp_id):
-    results = {
-        "feature": aspp_id,
-        "grading": score_grade_capabilities(df, aspp_id),
-        "consistency": score_inter_setup_deviation(df, aspp_id)
-    }
-    results["overall"] = np.mean([results["grading"], results["consistency"]])
-    return results
+def print_paper_tables(aspp_df_df):
+    print("Baseline")
+    for i, row in aspp_df_df.iterrows():
+        if "raw" in row["feature"]:
+            print("{} & {} & {} & {}\\\\".format(
+                row["feature"], round(row["grading"], 3), round(row["consistency"], 3), round(row["overall"], 3)))
+
+    print("ASPP 1")
+    for i, row in aspp_df_df.sort_values("overall", ascending=False)[:26].iterrows():
+        if "raw" in row["feature"]:
+            continue
+        print("{} & {} & {} & {}\\\\".format(
+            row["feature"], round(row["grading"], 3), round(row["consistency"], 3), round(row["overall"], 3)))
 
 
-def compute_aspp_scoring_df(df, list_of_aspp_ids):
+def compute_aspp_scoring_df(df, features, aspp_ids=None):
     print("[INFO] Scoring...")
-    aspp_df = []
-    for aspp_id in list_of_aspp_ids:
-        scores = score_aspp(df, aspp_id)
-        aspp_df.append(scores)
-    return pd.DataFrame(aspp_df)
+    if aspp_ids is not None:
+        features = features.select(aspp_ids)
+    scorer = FeatureScorer(df)
+    return scorer.score(features, features.aspp_ids)
 
 
-def merge_processed(list_of_processed):
-    merged = {}
-    for processed in list_of_processed:
-        for aspp_id in processed:
-            merged[aspp_id] = processed[aspp_id]
-    return merged
+def meta_hash(meta_df):
+    h = hashlib.sha1(",".join([str(c) for c in meta_df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(meta_df, index=False).values.tobytes())
+    return h.hexdigest()
 
 
-def main():
-    result_path = "./results"
-    check_n_make_dir(result_path)
-    result_path = os.path.join(result_path, "evaluate-aspp")
-    check_n_make_dir(result_path, clean=True)
+def load_evaluated(path, data_set_hash, scoring_hash):
+    """
+    :param scoring_hash: hash of the metadata used by the scores, see meta_hash
+    :return: FeatureMatrix and score table of a previous run on the same data set, None for the features if they
+    were computed on other signals and None for the scores if the metadata or the scoring changed
+    """
+    file_name = os.path.join(path, "features.npz")
+    if not os.path.isfile(file_name):
+        return None, None
+    known, header = FeatureMatrix.load(file_name)
+    if header.get("data_set_hash") != data_set_hash or header.get("version") != FEATURE_VERSION:
+        print("[INFO] Previous results belong to another data set or feature version, recomputing")
+        return None, None
+    print("[INFO] Loaded {} previously computed ASPPs".format(len(known.aspp_ids)))
+    if header.get("meta_hash") != scoring_hash or header.get("score_version") != SCORE_VERSION:
+        print("[INFO] Metadata or scoring changed since the previous run, rescoring all ASPPs")
+        return known, None
+    return known, pd.read_csv(os.path.join(path, "scores.csv"))
 
-    full_df = pd.read_csv("./data/zeb_data_set.csv")
-    full_df = digitize_grade(full_df)
 
-    # Define the Parameter Spaces
-    list_of_operations = [
-        "avg-3", "avg-5", "avg-7", "avg-9", "avg-11",
-        "rmp-3", "rmp-5", "rmp-7", "rmp-9", "rmp-11",
-        "bnd-00/25", "bnd-10/40", "bnd-25/50",
-        "bnd-00/10", "bnd-10/20", "bnd-20/30", "bnd-30/40", "bnd-40/50",
-    ]
+def save_evaluated(path, features, aspp_df, data_set_hash, scoring_hash):
+    check_n_make_dir(path)
+    aspp_df.to_csv(os.path.join(path, "scores.csv"), index=False)
+    features.save(os.path.join(path, "features.npz"), {
+        "data_set_hash": data_set_hash, "version": FEATURE_VERSION,
+        "meta_hash": scoring_hash, "score_version": SCORE_VERSION,
+    })
+
+
+def score_incremental(meta_df, features, known, known_scores):
+    """
+    scores only the ASPPs without a previous score and merges them into the previous score table
+    :return: score table of the ASPPs in features, score table of all ASPPs to keep for later runs
+    """
+    if known_scores is None:
+        aspp_df = compute_aspp_scoring_df(meta_df, features)
+        return aspp_df, aspp_df
+    scored = set(known_scores["feature"])
+    new_ids = [aspp_id for aspp_id in features.aspp_ids if aspp_id not in scored]
+    print("[INFO] {} of {} ASPPs already scored".format(len(features.aspp_ids) - len(new_ids), len(features.aspp_ids)))
+    all_scores = known_scores
+    if len(new_ids) > 0:
+        all_scores = pd.concat([known_scores, compute_aspp_scoring_df(meta_df, features, new_ids)], ignore_index=True)
+    aspp_df = all_scores[all_scores["feature"].isin(features.aspp_ids)].reset_index(drop=True)
+    return aspp_df, all_scores
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data", default="./data/zeb_data_set.csv", help="csv file or directory of a binary data set")
+    parser.add_argument(
+        "--cache", default="./results/feature-cache", help="directory of the feature cache, empty to disable")
+    parser.add_argument("--cache_size", type=float, default=10, help="maximum size of the feature cache in GB")
+    parser.add_argument("--max_complexity", type=int, default=2, help="maximum number of operations per ASPP")
+    parser.add_argument(
+        "--search", default="grid", choices=["grid", "halving", "beam"],
+        help="evaluate the full grid, search it with successive halving or grow ASPPs with a beam search")
+    parser.add_argument("--budget", type=float, default=0.1, help="fraction of segments in the first halving round")
+    parser.add_argument("--keep_ratio", type=float, default=0.25, help="fraction of ASPPs kept per halving round")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the segment sampling")
+    parser.add_argument("--beam_width", type=int, default=10, help="number of prefixes kept by the beam search")
+    parser.add_argument(
+        "--chunk_size", type=int, default=0,
+        help="if set, the data set is streamed in chunks of this many rows and only the scores are computed")
+    parser.add_argument(
+        "--shard", default="", help="i/N computes only the i-th of N shards of the grid and writes it to --shard_dir")
+    parser.add_argument("--shard_by", default="index", choices=["index", "hash"], help="partitioning of the grid")
+    parser.add_argument("--shard_dir", default="./results/shards", help="shared directory of the shard files")
+    parser.add_argument(
+        "--merge_shards", action="store_true", help="score the grid from the shard files instead of computing it")
+    parser.add_argument(
+        "--evaluated", default="./results/evaluated",
+        help="directory of the features and scores of previous grid runs, only new ASPPs are computed, "
+             "empty to disable")
+    parser.add_argument("--no_plots", action="store_true", help="only write the scores, no figures")
+    parser.add_argument("--plot_processes", type=int, default=None, help="number of processes rendering figures")
+    parser.add_argument(
+        "--profile", action="store_true", help="print calls, time and bytes per operation and aggregation")
+    return parser.parse_args()
+
 
-    list_of_aggregations = ["RMS", "STD", "MAX", "MOM", "MFFT"]
+def create_grid(max_complexity):
+    list_of_aspp = []
+    for complexity in range(max_complexity + 1):
+        list_of_aspp += GeneralASPP(LIST_OF_OPERATIONS, LIST_OF_AGGREGATIONS, complexity=complexity).create()
+    return list_of_aspp
 
-    g_aspp_0 = GeneralASPP(list_of_operations, list_of_aggregations, complexity=0)
-    processed_0 = g_aspp_0.compute_df(full_df)
 
-    g_aspp_1 = GeneralASPP(list_of_operations, list_of_aggregations, complexity=1)
-    processed_1 = g_aspp_1.compute_df(full_df)
+def run_successive_halving(args, full_df, signals, cache, result_path):
+    list_of_aspp = create_grid(args.max_complexity)
+    search = SuccessiveHalvingSearch(
+        list_of_aspp, budget=args.budget, keep_ratio=args.keep_ratio, seed=args.seed,
+        share_prefixes=True, cache=cache
+    )
+    aspp_df = search.run(full_df, signals)
+    aspp_df.to_csv(os.path.join(result_path, "successive-halving.csv"), index=False)
+    print(aspp_df.head(25))
 
-    g_aspp_2 = GeneralASPP(list_of_operations, list_of_aggregations, complexity=2)
-    processed_2 = g_aspp_2.compute_df(full_df)
 
-    processed = merge_processed([processed_0, processed_1, processed_2])
-    aspp_ids = [aspp_id for aspp_id in processed]
+def run_beam_search(args, full_df, signals, result_path):
+    search = BeamSearch(
+        LIST_OF_OPERATIONS, LIST_OF_AGGREGATIONS, beam_width=args.beam_width, max_complexity=args.max_complexity)
+    aspp_df = search.run(full_df, signals)
+    aspp_df.to_csv(os.path.join(result_path, "beam-search.csv"), index=False)
+    with open(os.path.join(result_path, "beam-search-examined.txt"), "w") as f:
+        f.write("\n".join(search.examined))
+    print("[INFO] {} ASPPs examined".format(len(search.examined)))
+    print(aspp_df.head(25))
+
+
+def run_chunked(args, cache, result_path):
+    list_of_aspp = create_grid(args.max_complexity)
+    chunks = iterate_data_set(args.data, args.chunk_size)
+    meta_df, features = compute_chunked(
+        list_of_aspp, chunks, os.path.join(result_path, "features"), share_prefixes=True, cache=cache)
+    aspp_df = compute_aspp_scoring_df(meta_df, features)
+    aspp_df.to_csv(os.path.join(result_path, "scores.csv"), index=False)
+    print(aspp_df.sort_values("overall", ascending=False).head(25))
+
+
+def run_shard(args, signals, cache):
+    shard_index, n_shards = [int(s) for s in args.shard.split("/")]
+    list_of_aspp = create_grid(args.max_complexity)
+    shard = select_shard(list_of_aspp, shard_index, n_shards, by=args.shard_by)
+    print("[INFO] Computing shard {} of {} with {} ASPPs".format(shard_index, n_shards, len(shard)))
+    features = compute_aspp_matrix(shard, signals, share_prefixes=True, cache=cache)
+    save_shard(
+        args.shard_dir, features, shard_index, n_shards, args.shard_by,
+        grid_fingerprint(list_of_aspp), signals.content_hash()
+    )
+
+
+def main(args):
+    profiling.enable(args.profile)
+    result_path = "./results"
+    check_n_make_dir(result_path)
+    if args.shard:
+        # shards run concurrently on several nodes and must not clean the shared result directory
+        _, signals = load_data_set(args.data)
+        cache = FeatureCache(args.cache, max_bytes=int(args.cache_size * 1e9)) if args.cache else None
+        run_shard(args, signals, cache)
+        return
+    # results are overwritten by name and not cleaned, so that unchanged figures are not rendered again
+    result_path = os.path.join(result_path, "evaluate-aspp")
+    check_n_make_dir(result_path)
+
+    if args.chunk_size > 0:
+        cache = FeatureCache(args.cache, max_bytes=int(args.cache_size * 1e9)) if args.cache else None
+        run_chunked(args, cache, result_path)
+        return
+
+    full_df, signals = load_data_set(args.data)
+    full_df = digitize_grade(full_df)
+    cache = FeatureCache(args.cache, max_bytes=int(args.cache_size * 1e9)) if args.cache else None
+
+    if args.search == "halving":
+        run_successive_halving(args, full_df, signals, cache, result_path)
+        return
+    if args.search == "beam":
+        run_beam_search(args, full_df, signals, result_path)
+        return
 
-    # Add Information to score features and to generate plots
-    processed["gtr - grade"] = full_df["gtr - grade"]
-    processed["ZWAUN_15"] = full_df["ZWAUN_15"]
-    processed["AUN"] = full_df["AUN"]
-    processed["setup"] = full_df["setup"]
-    processed["car"] = full_df["car"]
-    processed["phone"] = full_df["phone"]
-    processed["segment_id"] = full_df["segment_id"]
-    processed["source"] = full_df["source"]
-    processed["vel [km/h]"] = full_df["vel [km/h]"]
-    processed["vel [km/h] (r)"] = full_df["vel [km/h] (r)"]
+    meta_df = full_df[META_COLUMNS]
+    if args.merge_shards:
+        features = merge_shards(args.shard_dir, create_grid(args.max_complexity), signals.content_hash())
+        aspp_df = compute_aspp_scoring_df(meta_df, features)
+    else:
+        known, known_scores = None, None
+        scoring_hash = meta_hash(meta_df)
+        if args.evaluated:
+            known, known_scores = load_evaluated(args.evaluated, signals.content_hash(), scoring_hash)
+        list_of_features = []
+        for complexity in range(args.max_complexity + 1):
+            g_aspp = GeneralASPP(LIST_OF_OPERATIONS, LIST_OF_AGGREGATIONS, complexity=complexity)
+            list_of_features.append(g_aspp.compute(signals, share_prefixes=True, cache=cache, known=known))
+        features = FeatureMatrix.merge(list_of_features)
+        aspp_df, all_scores = score_incremental(meta_df, features, known, known_scores)
+        if args.evaluated:
+            # ASPPs which are no longer in the grid are kept for later runs
+            kept = [] if known is None else [aspp_id for aspp_id in known.aspp_ids if aspp_id not in features]
+            all_features = FeatureMatrix.merge([features, known.select(kept)]) if len(kept) > 0 else features
+            save_evaluated(args.evaluated, all_features, all_scores, signals.content_hash(), scoring_hash)
 
-    processed = pd.DataFrame(processed)
-    aspp_df = compute_aspp_scoring_df(processed, aspp_ids)
-    plots_for_papers(aspp_df, processed, result_path)
+    aspp_df.to_csv(os.path.join(result_path, "scores.csv"), index=False)
+    print_paper_tables(aspp_df)
+    if args.no_plots:
+        return
+    # seaborn and matplotlib are only imported when figures are rendered
+    from util.article_plots import plots_for_papers
+    paper_aspps = [AccelerometerSignalProcessingPipeline(operation_ids, aggregation_id)
+                   for operation_ids, aggregation_id in PAPER_ASPPS]
+    missing = [aspp for aspp in paper_aspps if str(aspp) not in features]
+    if len(missing) > 0:
+        features = FeatureMatrix.merge([features, compute_aspp_matrix(missing, signals, cache=cache)])
+    processed = features.to_frame(meta_df, aspp_ids=[str(aspp) for aspp in paper_aspps])
+    plots_for_papers(aspp_df, processed, result_path, processes=args.plot_processes)
 
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
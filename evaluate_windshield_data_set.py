@@ -1,100 +1,115 @@
-import numpy as np
 import pandas as pd
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
+import matplotlib
+matplotlib.use("Agg")
 import seaborn as sns
 import matplotlib.pyplot as plt
-from data_access_lib.utils import check_n_make_dir
+from util.path import check_n_make_dir
 
-from processing.processing_pipeline import AccelerometerSignalProcessingPipeline
+from processing.processing_pipeline import AccelerometerSignalProcessingPipeline, compute_aspp_matrix
+from util.data_set import load_data_set, SIGNAL_COLUMN
 
 from util.score import score_inter_setup_deviation_raw
 
 
-def main():
+ASPPS = [
+    ([], "RMS"),
+    (["avg-5"], "STD"),
+    (["avg-3", "avg-3"], "RMS"),
+]
+
+# Every experiment selects the rows of some accounts and compares the groups of its notes,
+# which are renamed to the labels shown in the plot
+EXPERIMENTS = [
+    {
+        "name": "Mounting Strength Test",
+        "accounts": ["Mounting Strength Test"],
+        "hue": "Mounting",
+        "labels": {"Exp. 4 - Loose Mounting": "Loose", "Exp. 4 - Tight Mounting": "Tight"},
+        "file_name": "mounting-strength.png",
+    },
+    {
+        "name": "Mounting Type Test",
+        "accounts": ["Mounting Type Test"],
+        "hue": "Mounting",
+        "labels": {"Exp. 5 - New Mounting": "2 Joints", "Exp. 5 -Old Mounting": "1 Joint"},
+        "file_name": "mounting-type.png",
+    },
+    {
+        "name": "Unevenness Test Position",
+        "accounts": ["Unevenness Test Position"],
+        "hue": "Position",
+        "labels": {"Exp. 1 - Position-1": "Middle", "Exp. 1 - Position-2": "Right"},
+        "file_name": "mounting-position.png",
+    },
+    {
+        "name": "Phone Type Test",
+        "accounts": ["Phone Type Test", "Phone Type Test 2"],
+        "hue": "Smartphone",
+        "labels": {
+            "Exp. 8 - iPhone 13 (no case)": "iPhone 13 (no case)",
+            "Exp. 8 - iPhone XR (no case)": "iPhone XR (no case)",
+            "Exp. 6 - Smartphone 13": "iPhone 13",
+            "Exp. 6 - Smartphone XR": "iPhone XR",
+        },
+        "hue_order": ["iPhone 13", "iPhone XR (no case)", "iPhone XR", "iPhone 13 (no case)"],
+        "file_name": "smartphone-type.png",
+    },
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data", default="./data/windshield_data_set.csv", help="csv file or directory of a binary data set")
+    parser.add_argument("--processes", type=int, default=None, help="number of experiments run in parallel")
+    return parser.parse_args()
+
+
+def run_experiment(experiment, df, aspp_ids, results_path):
+    """
+    scores the ASPPs on the rows of an experiment and plots them
+    :return: dict mapping aspp_id to the inter setup deviation score
+    """
+    scores = {f: score_inter_setup_deviation_raw(df, f) for f in aspp_ids}
+    df = pd.melt(
+        df, value_name="Unevenness Prediction", value_vars=aspp_ids, var_name="ASPP", id_vars=["note", "car", "phone"])
+    df[experiment["hue"]] = df["note"]
+    df = df.replace({experiment["hue"]: experiment["labels"]})
+    sns.boxplot(
+        data=df, x="ASPP", y="Unevenness Prediction", hue=experiment["hue"], hue_order=experiment.get("hue_order"))
+    plt.tight_layout()
+    plt.savefig(os.path.join(results_path, experiment["file_name"]))
+    plt.close()
+    return scores
+
+
+def main(args):
     results_path = "./results"
     check_n_make_dir(results_path)
     results_path = os.path.join(results_path, "analyze-windshield-parameters")
     check_n_make_dir(results_path, clean=True)
 
-    df = pd.read_csv("./data/windshield_data_set.csv")
-
-    aspp_0 = AccelerometerSignalProcessingPipeline([], "RMS")
-    aspp_1 = AccelerometerSignalProcessingPipeline(["avg-5"], "STD")
-    aspp_2 = AccelerometerSignalProcessingPipeline(["avg-3", "avg-3"], "RMS")
+    df, signals = load_data_set(args.data)
 
-    aspp_list = [aspp_0, aspp_1, aspp_2]
+    aspp_list = [AccelerometerSignalProcessingPipeline(operation_ids, aggregation_id)
+                 for operation_ids, aggregation_id in ASPPS]
     aspp_ids = [str(aspp) for aspp in aspp_list]
-
-    for aspp in aspp_list:
-        df[str(aspp)] = aspp.compute_df(df)
-
-    id_vars = ["note", "car", "phone"]
-    
-    print("Mounting Strength Test")
-    df_one = df[df["account"] == "Mounting Strength Test"]
-    for f in aspp_ids:
-        sc = score_inter_setup_deviation_raw(df_one, f)
-        print("{}: {}".format(f, sc))
-    df_one = pd.melt(
-        df_one, value_name="Unevenness Prediction", value_vars=aspp_ids, var_name="ASPP", id_vars=id_vars)
-    df_one["Mounting"] = df_one["note"]
-    df_one = df_one.replace({"Mounting": {"Exp. 4 - Loose Mounting": "Loose", "Exp. 4 - Tight Mounting": "Tight"}})
-    sns.boxplot(data=df_one, x="ASPP", y="Unevenness Prediction", hue="Mounting")
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_path, "mounting-strength.png"))
-    plt.close()
-
-    df_one = df[df["account"] == "Mounting Type Test"]
-    print("Mounting Type Test")
-    for f in aspp_ids:
-        sc = score_inter_setup_deviation_raw(df_one, f)
-        print("{}: {}".format(f, sc))
-    df_one = pd.melt(
-        df_one, value_name="Unevenness Prediction", value_vars=aspp_ids, var_name="ASPP", id_vars=id_vars)
-    df_one["Mounting"] = df_one["note"]
-    df_one = df_one.replace({"Mounting": {"Exp. 5 - New Mounting": "2 Joints", "Exp. 5 -Old Mounting": "1 Joint"}})
-    sns.boxplot(data=df_one, x="ASPP", y="Unevenness Prediction", hue="Mounting")
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_path, "mounting-type.png"))
-    plt.close()
-
-    df_one = df[df["account"] == "Unevenness Test Position"]
-    print("Unevenness Test Position")
-    for f in aspp_ids:
-        sc = score_inter_setup_deviation_raw(df_one, f)
-        print("{}: {}".format(f, sc))
-    df_one = pd.melt(
-        df_one, value_name="Unevenness Prediction", value_vars=aspp_ids, var_name="ASPP", id_vars=id_vars)
-    df_one["Position"] = df_one["note"]
-    df_one = df_one.replace({"Position": {"Exp. 1 - Position-1": "Middle", "Exp. 1 - Position-2": "Right"}})
-    sns.boxplot(data=df_one, x="ASPP", y="Unevenness Prediction", hue="Position")
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_path, "mounting-position.png"))
-    plt.close()
-
-    df_one = df[df["account"].isin(["Phone Type Test", "Phone Type Test 2"])]
-    print("Phone Type Test")
-    for f in aspp_ids:
-        sc = score_inter_setup_deviation_raw(df_one, f)
-        print("{}: {}".format(f, sc))
-    df_one = pd.melt(
-        df_one, value_name="Unevenness Prediction", value_vars=aspp_ids, var_name="ASPP", id_vars=id_vars)
-    df_one["Smartphone"] = df_one["note"]
-    df_one = df_one.replace({"Smartphone": {
-        "Exp. 8 - iPhone 13 (no case)": "iPhone 13 (no case)",
-        "Exp. 8 - iPhone XR (no case)": "iPhone XR (no case)",
-        "Exp. 6 - Smartphone 13": "iPhone 13",
-        "Exp. 6 - Smartphone XR": "iPhone XR",
-    }})
-    sns.boxplot(data=df_one, x="ASPP", y="Unevenness Prediction", hue="Smartphone", hue_order=[
-        "iPhone 13", "iPhone XR (no case)", "iPhone XR", "iPhone 13 (no case)"
-    ])
-    plt.tight_layout()
-    plt.savefig(os.path.join(results_path, "smartphone-type.png"))
-    plt.close()
-
-
+    features = compute_aspp_matrix(aspp_list, signals, share_prefixes=True, processes=args.processes)
+    df = features.to_frame(df.drop(columns=[SIGNAL_COLUMN], errors="ignore"), aspp_ids)
+
+    with ProcessPoolExecutor(args.processes) as executor:
+        futures = []
+        for experiment in EXPERIMENTS:
+            df_one = df[df["account"].isin(experiment["accounts"])]
+            futures.append(executor.submit(run_experiment, experiment, df_one, aspp_ids, results_path))
+        for experiment, future in zip(EXPERIMENTS, futures):
+            print(experiment["name"])
+            for f, sc in future.result().items():
+                print("{}: {}".format(f, sc))
 
     print("[INFO]: {} Data Points".format(len(df)))
     print("[INFO]: {} Accounts".format(len(df["account"].unique())))
@@ -103,4 +118,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
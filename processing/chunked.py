@@ -0,0 +1,48 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from processing.processing_pipeline import compute_aspp_matrix
+from processing.feature_matrix import FeatureMatrix
+
+
+def compute_chunked(list_of_aspp, chunks, path, **compute_kwargs):
+    """
+    computes the ASPPs chunk by chunk and appends the features of every chunk to a rows x ASPPs float32 matrix
+    on disk (features.f32) and the metadata to meta.csv, so that the memory needed does not grow with the data set
+    :param list_of_aspp: list of AccelerometerSignalProcessingPipeline
+    :param chunks: iterable of (data frame, SignalStore) pairs, e.g. from util.data_set.iterate_data_set
+    :param path: target directory
+    :param compute_kwargs: passed to compute_aspp_matrix
+    :return: metadata data frame and memory mapped FeatureMatrix
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    aspp_ids = [str(aspp) for aspp in list_of_aspp]
+    rows = 0
+    with open(os.path.join(path, "features.f32"), "wb") as f:
+        for i, (df, signals) in enumerate(chunks):
+            print("[INFO] Chunk {}: rows {} to {}".format(i, rows, rows + len(signals)))
+            features = compute_aspp_matrix(list_of_aspp, signals, **compute_kwargs)
+            f.write(np.ascontiguousarray(features.to_numpy()).tobytes())
+            df.drop(columns=["raw_accelerometer_signal"], errors="ignore").to_csv(
+                os.path.join(path, "meta.csv"), mode="w" if i == 0 else "a", header=i == 0, index=False)
+            rows += len(signals)
+    with open(os.path.join(path, "features.json"), "w") as f:
+        json.dump({"rows": rows, "aspp_ids": aspp_ids}, f)
+    return load_chunked(path)
+
+
+def load_chunked(path):
+    """
+    :return: metadata data frame and memory mapped FeatureMatrix
+    """
+    with open(os.path.join(path, "features.json")) as f:
+        header = json.load(f)
+    shape = (header["rows"], len(header["aspp_ids"]))
+    if shape[0] * shape[1] == 0:
+        features = np.zeros(shape, dtype=np.float32)
+    else:
+        features = np.memmap(os.path.join(path, "features.f32"), dtype=np.float32, mode="r", shape=shape)
+    return pd.read_csv(os.path.join(path, "meta.csv")), FeatureMatrix(features, header["aspp_ids"])
@@ -0,0 +1,92 @@
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from processing import profiling
+from processing.signal_store import SignalStore
+
+
+_worker = {}
+
+
+def share_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def attach_array(description):
+    name, shape, dtype = description
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def init_worker(values_description, offsets_description, function, jobs, profile=False):
+    profiling.enable(profile)
+    values_shm, values = attach_array(values_description)
+    offsets_shm, offsets = attach_array(offsets_description)
+    _worker["shm"] = [values_shm, offsets_shm]
+    _worker["signals"] = SignalStore(values, offsets)
+    _worker["function"] = function
+    _worker["jobs"] = jobs
+
+
+def run_job(job_index):
+    processed = _worker["function"](_worker["jobs"][job_index], _worker["signals"])
+    return {aspp_id: np.asarray(y, dtype=np.float32) for aspp_id, y in processed.items()}
+
+
+def run_profiled_job(job_index):
+    """
+    runs a job like run_job
+    :return: the result and the counters recorded by the worker for this job
+    """
+    profiling.reset()
+    start = time.perf_counter()
+    processed = run_job(job_index)
+    profiling.record("job", start, 0)
+    return processed, profiling.snapshot()
+
+
+class SharedSignalExecutor:
+    """
+    Worker pool that places the decoded signals in shared memory once. Workers attach to it without copying
+    and receive the jobs once at start up, so every task only transfers a job index.
+    """
+    def __init__(self, signals, processes=None, chunksize=1):
+        self.signals = signals
+        self.processes = processes
+        self.chunksize = chunksize
+
+    def map(self, function, jobs):
+        """
+        :param function: called as function(job, signals) and returning a dict mapping aspp_id to values
+        :param jobs: list of jobs, e.g. ASPPs or prefix trees
+        :return: list of dicts mapping aspp_id to float32 arrays, one per job
+        """
+        values_shm = share_array(self.signals.values)
+        offsets_shm = share_array(self.signals.offsets)
+        values_description = (values_shm.name, self.signals.values.shape, self.signals.values.dtype)
+        offsets_description = (offsets_shm.name, self.signals.offsets.shape, self.signals.offsets.dtype)
+        start = time.perf_counter()
+        try:
+            init_args = (values_description, offsets_description, function, jobs, profiling.ENABLED)
+            with Pool(self.processes, initializer=init_worker, initargs=init_args) as p:
+                results = list(tqdm(
+                    p.imap(run_profiled_job if profiling.ENABLED else run_job, range(len(jobs)),
+                           chunksize=self.chunksize),
+                    total=len(jobs), desc="[INFO] Jobs"
+                ))
+        finally:
+            for shm in [values_shm, offsets_shm]:
+                shm.close()
+                shm.unlink()
+        if profiling.ENABLED:
+            # counters of the workers are merged into the counters of this process
+            for _, counters in results:
+                profiling.merge(counters)
+            results = [processed for processed, _ in results]
+            profiling.record("pool (incl. start up and transfer)", start, 0)
+        return results
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+# increase whenever a change of the code changes the computed features
+FEATURE_VERSION = 1
+
+
+class FeatureCache:
+    """
+    On-disk cache of computed ASPP features, keyed by the data set content hash, the canonical ASPP id and
+    the feature version. When the cache grows beyond max_bytes, the least recently used entries are removed.
+    """
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def file_name(self, data_set_hash, canonical_id):
+        key = "{}|{}|{}".format(data_set_hash, canonical_id, FEATURE_VERSION)
+        return os.path.join(self.path, "{}.npy".format(hashlib.sha1(key.encode()).hexdigest()))
+
+    def get(self, data_set_hash, canonical_id):
+        file_name = self.file_name(data_set_hash, canonical_id)
+        if not os.path.isfile(file_name):
+            return None
+        try:
+            values = np.load(file_name)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            pass  # evicted by another process in the meantime
+        return values
+
+    def put(self, data_set_hash, canonical_id, values):
+        file_name = self.file_name(data_set_hash, canonical_id)
+        # a unique temporary file per writer, several processes (e.g. shards) may share the cache
+        fd, tmp_file_name = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(values, dtype=np.float32))
+        new_bytes = os.path.getsize(tmp_file_name)
+        try:
+            replaced_bytes = os.path.getsize(file_name)
+        except FileNotFoundError:
+            replaced_bytes = 0
+        os.replace(tmp_file_name, file_name)
+        if self.max_bytes is None:
+            return
+        if self.total_bytes is None:
+            self.total_bytes = self.size()
+        else:
+            self.total_bytes += new_bytes - replaced_bytes
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """
+        :return: list of (mtime, size, file name) of the cached entries, entries removed meanwhile by another
+        process are skipped
+        """
+        entries = []
+        for f in os.listdir(self.path):
+            if f.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.path, f))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, f))
+        return entries
+
+    def size(self):
+        return sum([size for _, size, _ in self.entries()])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum([size for _, size, _ in entries])
+        for _, size, f in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, f))
+            except FileNotFoundError:
+                pass  # evicted by another process
+            total -= size
+        self.total_bytes = total
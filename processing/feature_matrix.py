@@ -0,0 +1,103 @@
+import os
+import json
+import numpy as np
+
+
+class FeatureMatrix:
+    """
+    Computed ASPP features as one or more rows x ASPPs float32 blocks with an index from aspp_id to block column.
+    Merging matrices only joins their block lists without copying, a DataFrame is only built on request.
+    """
+    def __init__(self, values, aspp_ids):
+        if values.shape[1] != len(aspp_ids):
+            raise ValueError("{} columns but {} aspp_ids".format(values.shape[1], len(aspp_ids)))
+        self.blocks = [(values, list(aspp_ids))]
+        self.build_index()
+
+    @classmethod
+    def merge(cls, matrices):
+        """
+        :return: FeatureMatrix with the columns of all matrices, the blocks are shared and not copied
+        """
+        merged = cls.__new__(cls)
+        merged.blocks = [block for matrix in matrices for block in matrix.blocks]
+        if len(set([len(values) for values, _ in merged.blocks])) > 1:
+            raise ValueError("Feature matrices with different numbers of rows can not be merged")
+        merged.build_index()
+        return merged
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        :return: FeatureMatrix and header dict of a file written by save
+        """
+        with np.load(file_name) as data:
+            return cls(data["values"], data["aspp_ids"].tolist()), json.loads(str(data["header"]))
+
+    def save(self, file_name, header=None):
+        """
+        writes all columns and a json serializable header to an npz file, the file is replaced atomically
+        """
+        with open(file_name + ".tmp", "wb") as f:
+            np.savez(f, values=self.to_numpy(), aspp_ids=np.array(self.aspp_ids), header=json.dumps(header or {}))
+        os.replace(file_name + ".tmp", file_name)
+
+    def build_index(self):
+        self.index = {}
+        for i, (_, aspp_ids) in enumerate(self.blocks):
+            for j, aspp_id in enumerate(aspp_ids):
+                self.index[aspp_id] = (i, j)
+
+    @property
+    def aspp_ids(self):
+        return [aspp_id for _, aspp_ids in self.blocks for aspp_id in aspp_ids]
+
+    @property
+    def shape(self):
+        return len(self), sum([len(aspp_ids) for _, aspp_ids in self.blocks])
+
+    def __len__(self):
+        return len(self.blocks[0][0])
+
+    def __contains__(self, aspp_id):
+        return aspp_id in self.index
+
+    def __getitem__(self, aspp_id):
+        i, j = self.index[aspp_id]
+        return self.blocks[i][0][:, j]
+
+    def select(self, aspp_ids):
+        """
+        :return: FeatureMatrix with a copy of the selected columns
+        """
+        values = np.empty((len(self), len(aspp_ids)), dtype=np.float32)
+        for j, aspp_id in enumerate(aspp_ids):
+            values[:, j] = self[aspp_id]
+        return FeatureMatrix(values, aspp_ids)
+
+    def take_rows(self, rows):
+        """
+        :return: rows x ASPPs float64 array with the selected rows of all columns
+        """
+        return np.concatenate([np.asarray(values[rows], dtype=np.float64) for values, _ in self.blocks], axis=1)
+
+    def to_numpy(self):
+        if len(self.blocks) == 1:
+            return self.blocks[0][0]
+        return np.concatenate([values for values, _ in self.blocks], axis=1)
+
+    def as_dict(self):
+        return {aspp_id: self[aspp_id] for aspp_id in self.aspp_ids}
+
+    def to_frame(self, meta_df=None, aspp_ids=None):
+        """
+        :param meta_df: metadata columns added to the data frame, aligned with the rows
+        :param aspp_ids: feature columns of the data frame, all if None
+        :return: data frame with the metadata and feature columns
+        """
+        import pandas as pd
+        aspp_ids = self.aspp_ids if aspp_ids is None else aspp_ids
+        df = pd.DataFrame({aspp_id: self[aspp_id] for aspp_id in aspp_ids})
+        if meta_df is not None:
+            df = pd.concat([meta_df.reset_index(drop=True), df], axis=1)
+        return df
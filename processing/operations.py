@@ -1,21 +1,76 @@
+from functools import lru_cache
+
 import numpy as np
-import scipy
-from scipy import ndimage
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, lfilter, sosfilt, convolve
+
+from processing import profiling
 
 
 def encode_signal(acc_raw):
-    encoded_signal = ""
-    for x in acc_raw:
-        encoded_signal += "{},".format(x)
-    encoded_signal = encoded_signal[:-1]
-    return encoded_signal
+    return ",".join(["{}".format(x) for x in acc_raw])
+
+
+def encode_signals(signals):
+    return [encode_signal(acc_raw) for acc_raw in signals]
 
 
 def decode_signal(row):
     return np.fromstring(row["raw_accelerometer_signal"], dtype=np.float32, sep=",")
 
 
+def decode_signals(encoded_signals):
+    """
+    decodes many comma separated signals with a single parser call, missing signals are replaced by zeros(6)
+    :return: float32 values and offsets, the signal i is values[offsets[i]:offsets[i + 1]]
+    """
+    is_valid = np.array([isinstance(encoded_signal, str) for encoded_signal in encoded_signals], dtype=bool)
+    valid_signals = [encoded_signal for encoded_signal in encoded_signals if isinstance(encoded_signal, str)]
+    lengths = np.full(len(is_valid), 6, dtype=np.int64)
+    lengths[is_valid] = [encoded_signal.count(",") + 1 for encoded_signal in valid_signals]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+
+    values = np.zeros(offsets[-1], dtype=np.float32)
+    value_is_valid = np.repeat(is_valid, lengths)
+    parsed = np.fromstring(",".join(valid_signals), dtype=np.float32, sep=",")
+    if len(parsed) != np.sum(value_is_valid):
+        raise ValueError("Malformed signal, not every value could be decoded")
+    values[value_is_valid] = parsed
+    return values, offsets
+
+
+#### Batches ####
+# A batch holds many signals as a zero padded 2-D array (one signal per row) together with the signal lengths.
+
+
+def pad_signals(values, offsets):
+    lengths = np.diff(offsets)
+    max_length = np.max(lengths) if len(lengths) > 0 else 0
+    padded = np.zeros((len(lengths), max_length), dtype=values.dtype)
+    padded[padding_mask(lengths, max_length)] = values[offsets[0]:offsets[-1]]
+    return padded, lengths
+
+
+def unpad_signals(padded, lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return padded[padding_mask(lengths, padded.shape[1])], offsets
+
+
+def padding_mask(lengths, width):
+    return np.arange(width)[np.newaxis, :] < np.asarray(lengths)[:, np.newaxis]
+
+
+def clear_padding(padded, lengths):
+    padded[~padding_mask(lengths, padded.shape[1])] = 0
+    return padded
+
+
+def groups_by_length(lengths):
+    for length in np.unique(lengths):
+        yield length, np.flatnonzero(lengths == length)
+
+
 #### Aggergation ####
 
 def rms(signal):
@@ -34,16 +89,179 @@ def p90(signal):
     return np.percentile(signal, 90)
 
 
+def spectrum(signal):
+    return np.abs(np.fft.rfft(signal))
+
+
+def magnitude_weights(n):
+    # the spectrum of a real signal is symmetric, every rfft bin except 0 and n/2 stands for two fft bins
+    weights = np.full(n // 2 + 1, 2.0)
+    weights[0] = 1
+    if n % 2 == 0:
+        weights[-1] = 1
+    return weights
+
+
 def sum_of_magnitudes(signal):
-    return np.sum(np.abs(np.fft.fft(signal)))
+    return np.dot(spectrum(signal), magnitude_weights(len(signal)))
 
 
 def mean_of_magnitudes(signal):
-    return np.mean(np.abs(np.fft.fft(signal)))
+    return sum_of_magnitudes(signal) / len(signal)
 
 
 def max_of_fft(signal):
-    return np.max(np.abs(np.fft.fft(signal)))
+    return np.max(spectrum(signal))
+
+
+def mean_square(signal):
+    return np.mean(np.square(signal))
+
+
+def percentile_of_sorted(values, q):
+    # same as np.percentile(..., method="linear") for sorted values
+    position = q / 100 * (len(values) - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (position - lower) * (values[upper] - values[lower])
+
+
+class SharedIntermediates:
+    """
+    Intermediate results of one signal (spectrum, sorted values, moments) which are computed on first request
+    and then shared by all aggregations of that signal
+    """
+    catalogue = {
+        "spectrum": spectrum,
+        "sorted": np.sort,
+        "mean": np.mean,
+        "mean_square": mean_square,
+    }
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.computed = {}
+
+    def __getitem__(self, name):
+        if name not in self.computed:
+            self.computed[name] = self.catalogue[name](self.signal)
+        return self.computed[name]
+
+
+def rms_shared(shared):
+    return np.sqrt(shared["mean_square"])
+
+
+def std_shared(shared):
+    return np.sqrt(np.mean(np.square(shared.signal - shared["mean"])))
+
+
+def p10_shared(shared):
+    return percentile_of_sorted(shared["sorted"], 10)
+
+
+def p90_shared(shared):
+    return percentile_of_sorted(shared["sorted"], 90)
+
+
+def max_shared(shared):
+    return np.max(shared.signal)
+
+
+def mean_of_magnitudes_shared(shared):
+    n = len(shared.signal)
+    return np.dot(shared["spectrum"], magnitude_weights(n)) / n
+
+
+def max_of_fft_shared(shared):
+    return np.max(shared["spectrum"])
+
+
+def aggregate(signal, aggregation_ids):
+    """
+    computes several aggregations of one signal, intermediates needed by more than one of them are computed once
+    :return: list with one value per aggregation id
+    """
+    aggregations_list = {
+        "RMS": rms_shared,
+        "STD": std_shared,
+        "P10": p10_shared,
+        "P90": p90_shared,
+        "MOM": mean_of_magnitudes_shared,
+        "MFFT": max_of_fft_shared,
+        "MAX": max_shared
+    }
+    shared = SharedIntermediates(signal)
+    return [aggregations_list[aggregation_id](shared) for aggregation_id in aggregation_ids]
+
+
+def rms_batch(padded, lengths):
+    return np.sqrt(np.sum(np.square(padded), axis=1) / lengths)
+
+
+def std_batch(padded, lengths):
+    mean = np.sum(padded, axis=1) / lengths
+    deviation = (padded - mean[:, np.newaxis]) * padding_mask(lengths, padded.shape[1])
+    return np.sqrt(np.sum(np.square(deviation), axis=1) / lengths)
+
+
+def percentile_batch(padded, lengths, q):
+    # same as np.percentile(..., method="linear") for every row, padding is sorted to the end
+    values = np.where(padding_mask(lengths, padded.shape[1]), padded, np.inf)
+    values = np.sort(values, axis=1)
+    position = q / 100 * (lengths - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, lengths - 1)
+    lower_values = np.take_along_axis(values, lower[:, np.newaxis], axis=1)[:, 0]
+    upper_values = np.take_along_axis(values, upper[:, np.newaxis], axis=1)[:, 0]
+    return lower_values + (position - lower) * (upper_values - lower_values)
+
+
+def p10_batch(padded, lengths):
+    return percentile_batch(padded, lengths, 10)
+
+
+def p90_batch(padded, lengths):
+    return percentile_batch(padded, lengths, 90)
+
+
+def max_batch(padded, lengths):
+    y = np.max(np.where(padding_mask(lengths, padded.shape[1]), padded, -np.inf), axis=1)
+    # nan for empty signals like the other batch aggregations
+    return np.where(lengths > 0, y, np.nan)
+
+
+def spectrum_batch(padded, lengths, reduce):
+    # the fft depends on the signal length, so signals are transformed in groups of equal length
+    y = np.zeros(len(lengths))
+    for length, rows in groups_by_length(lengths):
+        y[rows] = reduce(np.abs(np.fft.rfft(padded[rows, :length], axis=1)), length)
+    return y
+
+
+def sum_of_magnitudes_batch(padded, lengths):
+    return spectrum_batch(padded, lengths, lambda magnitudes, n: magnitudes @ magnitude_weights(n))
+
+
+def mean_of_magnitudes_batch(padded, lengths):
+    return spectrum_batch(padded, lengths, lambda magnitudes, n: magnitudes @ magnitude_weights(n) / n)
+
+
+def max_of_fft_batch(padded, lengths):
+    return spectrum_batch(padded, lengths, lambda magnitudes, n: np.max(magnitudes, axis=1))
+
+
+def get_batch_aggregation(aggregation_id):
+    aggregations_list = {
+        "RMS": rms_batch,
+        "STD": std_batch,
+        "P10": p10_batch,
+        "P90": p90_batch,
+        "MOM": mean_of_magnitudes_batch,
+        "MFFT": max_of_fft_batch,
+        "MAX": max_batch
+    }
+    return aggregations_list[aggregation_id]
 
 
 def get_aggregation(aggregation_id):
@@ -62,50 +280,208 @@ def get_aggregation(aggregation_id):
 #### Operations ####
 
 
-def butter_bandpass(lowcut, highcut, fs, order=5):
+def butter_bandpass(lowcut, highcut, fs, order=5, use_sos=False):
+    if use_sos:
+        return butter(order, [lowcut, highcut], fs=fs, btype='band', output='sos')
     return butter(order, [lowcut, highcut], fs=fs, btype='band')
 
 
-def butter_bandpass_filter(data, param, fs=100, order=5):
+def parse_band(param):
     lowcut, highcut = param.split("/")
-    lowcut, highcut = np.max([float(lowcut), 1]), np.min([float(highcut), 49])
-
-    b, a = butter_bandpass(float(lowcut), float(highcut), fs, order=order)
-    y = lfilter(b, a, data)
-    return y
+    return float(np.max([float(lowcut), 1])), float(np.min([float(highcut), 49]))
 
 
-def average_filter(data, kernel_size):
+def average_kernel(kernel_size):
     kernel_size = int(kernel_size)
-    kernel = np.ones(kernel_size) / kernel_size
-    return np.convolve(data, kernel)
+    return np.ones(kernel_size) / kernel_size
 
 
-def ramp_filter(data, kernel_size):
+def ramp_kernel(kernel_size):
     kernel_size = int(kernel_size)
     flank1 = np.arange(1, kernel_size)
     flank2 = np.arange(1, kernel_size)[::-1]
     kernel = np.concatenate([flank1, flank2])
-    kernel = kernel / np.sum(kernel)
+    return kernel / np.sum(kernel)
+
+
+def bandpass_design(op_param, fs=100, order=5, use_sos=False):
+    lowcut, highcut = parse_band(op_param)
+    return butter_bandpass(lowcut, highcut, fs, order=order, use_sos=use_sos)
+
+
+# designers of the operation types, called as designer(op_param, fs=fs, order=order, use_sos=use_sos)
+operation_designers = {
+    "avg": lambda op_param, **kwargs: average_kernel(op_param),
+    "rmp": lambda op_param, **kwargs: ramp_kernel(op_param),
+    "bnd": bandpass_design,
+}
+
+
+@lru_cache(maxsize=None)
+def design_operation(op_type, op_param, fs=100, order=5, use_sos=False):
+    """
+    designs the kernel (avg, rmp) or the filter coefficients (bnd) of an operation, every design is computed once.
+    Types without a designer, e.g. registered only in Operation.catalogue, get their parameter string as design.
+    :return: kernel array, (b, a) tuple, second-order sections array or op_param
+    """
+    if op_type not in operation_designers:
+        return op_param
+    return operation_designers[op_type](op_param, fs=fs, order=order, use_sos=use_sos)
+
+
+def convolve_signal(data, kernel):
     return np.convolve(data, kernel)
 
 
+def bandpass_signal(data, design, axis=-1):
+    if isinstance(design, tuple):
+        b, a = design
+        return lfilter(b, a, data, axis=axis)
+    return sosfilt(design, data, axis=axis)
+
+
+def butter_bandpass_filter(data, param, fs=100, order=5):
+    return bandpass_signal(data, design_operation("bnd", param, fs, order))
+
+
+def average_filter(data, kernel_size):
+    return convolve_signal(data, design_operation("avg", kernel_size))
+
+
+def ramp_filter(data, kernel_size):
+    return convolve_signal(data, design_operation("rmp", kernel_size))
+
+
 def gaussian_filter(data, kernel_size):
-    return ndimage.gaussian_filter1d(data, sigma=kernel_size)
+    from scipy import ndimage
+    return ndimage.gaussian_filter1d(data, sigma=float(kernel_size))
+
+
+def bandpass_batch(padded, lengths, design):
+    # the filter is causal, the padding only affects samples which are cleared afterwards
+    y = bandpass_signal(padded, design, axis=1)
+    return clear_padding(y, lengths), lengths
+
+
+def convolve_batch(padded, lengths, kernel):
+    # full convolution of zero padded signals equals the convolution of every signal followed by zeros
+    y = convolve(padded, kernel[np.newaxis, :], mode="full", method="auto")
+    return y, lengths + len(kernel) - 1
 
 
 class Operation:
+    """
+    catalogue maps every operation type to fn(signal, design), where design is computed by design_operation once
+    per operation. A catalogue entry alone defines an operation type, its design is then the parameter string,
+    e.g. Operation.catalogue["gau"] = gaussian_filter. batch_catalogue is optional and maps a type to
+    fn(padded, lengths, design), types without an entry are computed signal by signal in compute_batch.
+    """
+    linear_fir_types = ["avg", "rmp"]
     catalogue = {
-        "avg": average_filter,
-        "rmp": ramp_filter,
-        "bnd": butter_bandpass_filter
+        "avg": convolve_signal,
+        "rmp": convolve_signal,
+        "bnd": bandpass_signal
+    }
+    batch_catalogue = {
+        "avg": convolve_batch,
+        "rmp": convolve_batch,
+        "bnd": bandpass_batch,
     }
 
-    def __init__(self, op_id: str):
+    def __init__(self, op_id: str, fs=100, order=5, use_sos=False):
         self.op_type, self.op_param = op_id.split("-")
+        if self.op_type not in self.catalogue:
+            raise ValueError("Unknown operation type: {}".format(self.op_type))
+        self.fs, self.order, self.use_sos = fs, order, use_sos
+        self.design = design_operation(self.op_type, self.op_param, fs=fs, order=order, use_sos=use_sos)
     
     def __str__(self):
         return "{}{}".format(self.op_type, self.op_param)
 
+    def canonical_id(self):
+        """
+        :return: identifier that is equal for all operations computing the same result, e.g. bnd-00/10 and bnd-01/10
+        """
+        if self.op_type == "bnd":
+            lowcut, highcut = parse_band(self.op_param)
+            canonical = "bnd{:g}/{:g}@{}o{}".format(lowcut, highcut, self.fs, self.order)
+            if self.use_sos:
+                canonical += "sos"
+            return canonical
+        if self.op_type in self.linear_fir_types:
+            return "{}{}".format(self.op_type, int(self.op_param))
+        return str(self)
+
+    @property
+    def is_linear_fir(self):
+        return self.op_type in self.linear_fir_types
+
+    def compute(self, signal):
+        if profiling.ENABLED:
+            return profiling.call(
+                "operation {}-{}".format(self.op_type, self.op_param), self.catalogue[self.op_type], signal, self.design)
+        return self.catalogue[self.op_type](signal, self.design)
+
+    def compute_batch(self, padded, lengths=None):
+        """
+        computes the operation for a batch of signals
+        :param padded: 2-D array with one zero padded signal per row
+        :param lengths: length of every signal, defaults to the width of padded
+        :return: the filtered batch and the new signal lengths
+        """
+        if lengths is None:
+            lengths = np.full(len(padded), padded.shape[1])
+        if self.op_type not in self.batch_catalogue:
+            filtered = [self.compute(padded[i, :length]) for i, length in enumerate(lengths)]
+            offsets = np.concatenate([[0], np.cumsum([len(f) for f in filtered])]).astype(np.int64)
+            return pad_signals(np.concatenate(filtered + [np.zeros(0)]), offsets)
+        return self.batch_catalogue[self.op_type](padded, lengths, self.design)
+
+
+class FusedOperation:
+    """
+    Chain of consecutive linear FIR operations collapsed into a single kernel. The full convolution is associative,
+    so convolving with the combined kernel once equals applying the operations one after another.
+    """
+    def __init__(self, operations):
+        self.operations = operations
+        kernel = operations[0].design
+        for op in operations[1:]:
+            kernel = np.convolve(kernel, op.design)
+        self.design = kernel
+
+    def __str__(self):
+        return "".join([str(op) for op in self.operations])
+
     def compute(self, signal):
-        return self.catalogue[self.op_type](signal, self.op_param)
+        # chooses direct or fft convolution depending on signal and kernel size
+        if profiling.ENABLED:
+            return profiling.call("fused {}".format(self), convolve, signal, self.design, "full", "auto")
+        return convolve(signal, self.design, mode="full", method="auto")
+
+    def compute_batch(self, padded, lengths=None):
+        if lengths is None:
+            lengths = np.full(len(padded), padded.shape[1])
+        return convolve_batch(padded, lengths, self.design)
+
+
+def compile_operations(operations):
+    """
+    replaces every run of consecutive linear FIR operations by one FusedOperation
+    :param operations: list of Operation
+    :return: list of Operation and FusedOperation
+    """
+    compiled = []
+    run = []
+    for op in operations + [None]:
+        if op is not None and op.is_linear_fir:
+            run.append(op)
+            continue
+        if len(run) > 1:
+            compiled.append(FusedOperation(run))
+        else:
+            compiled += run
+        run = []
+        if op is not None:
+            compiled.append(op)
+    return compiled
@@ -0,0 +1,110 @@
+from processing import profiling
+from processing.operations import aggregate
+from processing.signal_store import as_signal_store
+
+
+class PrefixNode:
+    """
+    Node of a trie over the operation prefixes of a set of ASPPs. The signal filtered by the operations
+    on the path to a node is computed once and shared by all aggregations and children of that node.
+    """
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.children = {}
+        self.aggregations = {}
+
+    def add(self, aspp):
+        node = self
+        for op_id, op in zip(aspp.list_of_operations, aspp.pipe):
+            if op_id not in node.children:
+                node.children[op_id] = PrefixNode(op)
+            node = node.children[op_id]
+        node.aggregations[str(aspp)] = aspp.aggregation_id
+
+    def aspp_ids(self):
+        ids = list(self.aggregations)
+        for child in self.children.values():
+            ids += child.aspp_ids()
+        return ids
+
+    def split_children(self):
+        """
+        :return: list of nodes with the operation of this node, one with its aggregations and one for each child
+        """
+        parts = []
+        if len(self.aggregations) > 0:
+            part = PrefixNode(self.operation)
+            part.aggregations = self.aggregations
+            parts.append(part)
+        for op_id, child in self.children.items():
+            part = PrefixNode(self.operation)
+            part.children[op_id] = child
+            parts.append(part)
+        return parts
+
+    def split_at_branch(self):
+        """
+        splits the tree at its first node with more than one child or aggregation, the operations on the path to
+        that node are repeated in every sub tree
+        :return: list of root nodes, only this node if the tree has no branch
+        """
+        path = [(None, self)]
+        while len(path[-1][1].aggregations) == 0 and len(path[-1][1].children) == 1:
+            path.append(next(iter(path[-1][1].children.items())))
+        parts = path[-1][1].split_children()
+        if len(parts) < 2:
+            return [self]
+        for i in range(len(path) - 1, 0, -1):
+            parents = []
+            for part in parts:
+                parent = PrefixNode(path[i - 1][1].operation)
+                parent.children[path[i][0]] = part
+                parents.append(parent)
+            parts = parents
+        return parts
+
+    def split(self, n_parts=1):
+        """
+        splits the tree into independent sub trees, one for each first operation. While there are fewer sub trees
+        than n_parts (e.g. worker processes), the largest sub tree is split at its next branch, at the cost of
+        computing the operations before the branch once per sub tree
+        :return: list of root nodes
+        """
+        parts = self.split_children()
+        unsplittable = []
+        while len(parts) + len(unsplittable) < n_parts and len(parts) > 0:
+            largest = max(range(len(parts)), key=lambda i: len(parts[i].aspp_ids()))
+            part = parts.pop(largest)
+            sub_parts = part.split_at_branch()
+            if len(sub_parts) < 2:
+                unsplittable.append(part)
+            else:
+                parts += sub_parts
+        return parts + unsplittable
+
+    def process_signal(self, signal, results):
+        if self.operation is not None:
+            signal = self.operation.compute(signal)
+        aggregation_ids = list(self.aggregations.values())
+        if profiling.ENABLED and len(aggregation_ids) > 0:
+            values = profiling.call("aggregate {}".format(",".join(aggregation_ids)), aggregate, signal, aggregation_ids)
+        else:
+            values = aggregate(signal, aggregation_ids)
+        for aspp_id, value in zip(self.aggregations, values):
+            results[aspp_id].append(value)
+        for child in self.children.values():
+            child.process_signal(signal, results)
+
+    def compute_df(self, df):
+        signals = as_signal_store(df)
+        results = {aspp_id: [] for aspp_id in self.aspp_ids()}
+        for acc_raw in signals:
+            self.process_signal(acc_raw, results)
+        return results
+
+
+def build_prefix_tree(list_of_aspp):
+    root = PrefixNode()
+    for aspp in list_of_aspp:
+        root.add(aspp)
+    return root
@@ -1,19 +1,21 @@
+import os
 import numpy as np
-from tqdm import tqdm
-from sklearn.model_selection import ParameterGrid
 
-from multiprocessing import Pool
-
-from processing.operations import Operation, get_aggregation, decode_signal
+from processing import profiling
+from processing.operations import Operation, FusedOperation, compile_operations, get_aggregation, get_batch_aggregation, decode_signal
+from processing.signal_store import as_signal_store
+from processing.prefix_tree import build_prefix_tree
+from processing.feature_matrix import FeatureMatrix
 
 
 class AccelerometerSignalProcessingPipeline:
-    def __init__(self, operation_ids, aggregation_id):
+    def __init__(self, operation_ids, aggregation_id, use_sos=False):
         self.list_of_operations = operation_ids
         self.aggregation_id = aggregation_id
         self.aggregation = get_aggregation(aggregation_id)
 
-        self.pipe = [Operation(op_id) for op_id in self.list_of_operations]
+        self.pipe = [Operation(op_id, use_sos=use_sos) for op_id in self.list_of_operations]
+        self.compiled_pipe = compile_operations(self.pipe)
 
     def __str__(self):
         s = ""
@@ -24,30 +26,152 @@ class AccelerometerSignalProcessingPipeline:
         s += "-{}".format(self.aggregation_id)
         return s
 
+    def canonical_id(self):
+        """
+        identifier that is equal for all ASPPs computing the same values. Operations are identified by their
+        effective parameters and runs of linear FIR operations are sorted, since convolutions commute.
+        """
+        canonical_ops = []
+        for op in self.compiled_pipe:
+            if isinstance(op, FusedOperation):
+                canonical_ops += sorted([fir_op.canonical_id() for fir_op in op.operations])
+            else:
+                canonical_ops.append(op.canonical_id())
+        if len(canonical_ops) == 0:
+            canonical_ops.append("raw")
+        return "{}-{}".format(",".join(canonical_ops), self.aggregation_id)
+
     def process_signal(self, signal):
-        for op in self.pipe:
+        for op in self.compiled_pipe:
             signal = op.compute(signal)
+        if profiling.ENABLED:
+            return profiling.call("aggregation {}".format(self.aggregation_id), self.aggregation, signal)
         return self.aggregation(signal)
 
+    def process_batch(self, padded, lengths):
+        for op in self.compiled_pipe:
+            padded, lengths = op.compute_batch(padded, lengths)
+        return get_batch_aggregation(self.aggregation_id)(padded, lengths)
+
     def compute_df(self, df):
-        y = []
-        for _, row in df.iterrows():
-            if row["raw_accelerometer_signal"] is np.nan:
-                acc_raw = np.zeros(6)
-            else:
-                acc_raw = np.fromstring(row["raw_accelerometer_signal"], dtype=np.float32, sep=",")
-            y.append(self.process_signal(acc_raw))
+        signals = as_signal_store(df)
+        return [self.process_signal(acc_raw) for acc_raw in signals]
+
+    def compute_batch(self, df, batch_size=512):
+        """
+        computes the ASPP for batches of signals at once instead of one signal per call
+        :return: array with one value per signal
+        """
+        signals = as_signal_store(df)
+        y = np.zeros(len(signals))
+        for start in range(0, len(signals), batch_size):
+            padded, lengths = signals.to_padded(start, start + batch_size)
+            y[start:start + batch_size] = self.process_batch(padded, lengths)
         return y
     
 
-def execute(task):
-    aspp, df = task
-    return str(aspp), aspp.compute_df(df)
-    
+def execute(aspp, signals):
+    return {str(aspp): aspp.compute_df(signals)}
+
+
+def execute_tree(tree, signals):
+    return tree.compute_df(signals)
+
+
+def group_equivalent(list_of_aspp):
+    """
+    groups ASPPs by their canonical id, so that each distinct ASPP is evaluated once
+    :return: dict mapping canonical id to the list of equivalent ASPPs
+    """
+    distinct = {}
+    for aspp in list_of_aspp:
+        distinct.setdefault(aspp.canonical_id(), []).append(aspp)
+    print("[INFO] {} distinct ASPPs out of {} ({} evaluations saved)".format(
+        len(distinct), len(list_of_aspp), len(list_of_aspp) - len(distinct)))
+    return distinct
+
+
+def compute_distinct(list_of_aspp, signals, share_prefixes=False, processes=None, chunksize=1, cache=None):
+    """
+    computes every distinct ASPP of the list once
+    :return: dict mapping canonical id to a float32 array of values
+    """
+    distinct = group_equivalent(list_of_aspp)
+
+    merged = {}
+    if cache is not None:
+        data_set_hash = signals.content_hash()
+        for canonical_id, equivalent_aspp in distinct.items():
+            values = cache.get(data_set_hash, canonical_id)
+            if values is not None:
+                merged[canonical_id] = values
+        print("[INFO] {} of {} distinct ASPPs loaded from cache".format(len(merged), len(distinct)))
+
+    to_compute = {str(distinct[c][0]): c for c in distinct if c not in merged}
+    list_of_aspp_to_compute = [distinct[c][0] for c in to_compute.values()]
+    if len(list_of_aspp_to_compute) > 0:
+        print("[INFO] Evaluating...")
+        # multiprocessing is only imported by the grid, single ASPPs only need numpy and scipy
+        from processing.executor import SharedSignalExecutor
+        executor = SharedSignalExecutor(signals, processes=processes, chunksize=chunksize)
+        if share_prefixes:
+            # at least one sub tree per worker, the first operations alone give fewer jobs than workers on large machines
+            tree = build_prefix_tree(list_of_aspp_to_compute)
+            results = executor.map(execute_tree, tree.split(processes or os.cpu_count()))
+        else:
+            results = executor.map(execute, list_of_aspp_to_compute)
+        for result in results:
+            for aspp_id, values in result.items():
+                merged[to_compute[aspp_id]] = values
+                if cache is not None:
+                    cache.put(data_set_hash, to_compute[aspp_id], values)
+    return merged
+
+
+def compute_aspp_list(list_of_aspp, df, share_prefixes=False, processes=None, chunksize=1, cache=None):
+    """
+    computes a list of ASPPs, equivalent ASPPs are computed once
+    :param list_of_aspp: list of AccelerometerSignalProcessingPipeline
+    :param df: data frame or SignalStore
+    :param share_prefixes: if True the ASPPs are arranged in a prefix tree, so that every
+    intermediate filtered signal is computed once and shared by all ASPPs starting with it
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of jobs sent to a worker at once
+    :param cache: FeatureCache, cached ASPPs are loaded instead of computed
+    :return: dict mapping aspp_id to a float32 array of values
+    """
+    merged = compute_distinct(
+        list_of_aspp, as_signal_store(df),
+        share_prefixes=share_prefixes, processes=processes, chunksize=chunksize, cache=cache
+    )
+    processed = {}
+    for aspp in list_of_aspp:
+        processed[str(aspp)] = merged[aspp.canonical_id()]
+    return processed
+
+
+def compute_aspp_matrix(list_of_aspp, df, share_prefixes=False, processes=None, chunksize=1, cache=None):
+    """
+    computes a list of ASPPs like compute_aspp_list
+    :return: FeatureMatrix with one column per ASPP
+    """
+    signals = as_signal_store(df)
+    merged = compute_distinct(
+        list_of_aspp, signals,
+        share_prefixes=share_prefixes, processes=processes, chunksize=chunksize, cache=cache
+    )
+    aspp_ids = [str(aspp) for aspp in list_of_aspp]
+    values = np.empty((len(signals), len(aspp_ids)), dtype=np.float32)
+    for j, aspp in enumerate(list_of_aspp):
+        values[:, j] = merged[aspp.canonical_id()]
+    return FeatureMatrix(values, aspp_ids)
+
 
 class GeneralASPP:
-    def __init__(self, operations_to_consider, aggergations_to_consider, complexity: int):
+    def __init__(self, operations_to_consider, aggergations_to_consider, complexity: int, use_sos=False):
+        from sklearn.model_selection import ParameterGrid
         self.complexity = complexity
+        self.use_sos = use_sos
 
         param_space = {"op_{}".format(i+1): operations_to_consider for i in range(complexity)}
         param_space["aggregations"] = aggergations_to_consider
@@ -61,15 +185,52 @@ class GeneralASPP:
         list_of_aspp = []
         for conf in self.configs:
             operation_ids = [conf["op_{}".format(i+1)] for i in range(self.complexity)]
-            aspp = AccelerometerSignalProcessingPipeline(operation_ids, conf["aggregations"])
+            aspp = AccelerometerSignalProcessingPipeline(operation_ids, conf["aggregations"], use_sos=self.use_sos)
             list_of_aspp.append(aspp)
         return list_of_aspp
+
+    def create_distinct(self):
+        return group_equivalent(self.create())
     
-    def compute_df(self, df):
+    def compute(self, df, share_prefixes=False, processes=None, chunksize=1, cache=None, known=None):
+        """
+        computes all ASPPs of the grid, see compute_aspp_list
+        :param known: FeatureMatrix of previously computed ASPPs on the same data, only ASPPs missing in it
+        are computed
+        :return: FeatureMatrix with one column per ASPP
+        """
         list_of_aspp = self.create()
-        print("[INFO] Evaluating...")
-        task_list = [[aspp, df] for aspp in list_of_aspp]
-        with Pool() as p:
-            results = p.map(execute, task_list)
-        processed = {aspp_id: y for aspp_id, y in results}
+        if known is None:
+            features = compute_aspp_matrix(
+                list_of_aspp, df,
+                share_prefixes=share_prefixes, processes=processes, chunksize=chunksize, cache=cache
+            )
+        else:
+            known_ids = [str(aspp) for aspp in list_of_aspp if str(aspp) in known]
+            new_aspp = [aspp for aspp in list_of_aspp if str(aspp) not in known]
+            print("[INFO] {} of {} ASPPs already computed".format(len(known_ids), len(list_of_aspp)))
+            matrices = [known.select(known_ids)]
+            if len(new_aspp) > 0:
+                matrices.append(compute_aspp_matrix(
+                    new_aspp, df,
+                    share_prefixes=share_prefixes, processes=processes, chunksize=chunksize, cache=cache
+                ))
+            features = FeatureMatrix.merge(matrices)
+        if profiling.ENABLED:
+            profiling.report()
+            profiling.reset()
+        return features
+
+    def compute_df(self, df, share_prefixes=False, processes=None, chunksize=1, cache=None):
+        """
+        computes all ASPPs of the grid, see compute_aspp_list
+        :return: dict mapping aspp_id to a float32 array of values
+        """
+        processed = compute_aspp_list(
+            self.create(), df,
+            share_prefixes=share_prefixes, processes=processes, chunksize=chunksize, cache=cache
+        )
+        if profiling.ENABLED:
+            profiling.report()
+            profiling.reset()
         return processed
@@ -0,0 +1,58 @@
+import time
+
+
+# instrumentation is opt-in, the hot paths only check this flag when it is disabled
+ENABLED = False
+_counters = {}
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    _counters.clear()
+
+
+def record(key, start, n_bytes):
+    counter = _counters.setdefault(key, [0, 0.0, 0])
+    counter[0] += 1
+    counter[1] += time.perf_counter() - start
+    counter[2] += n_bytes
+
+
+def call(key, function, signal, *args):
+    """
+    calls function(signal, *args) and records the call, its wall time and the bytes of signal under key
+    """
+    start = time.perf_counter()
+    y = function(signal, *args)
+    record(key, start, signal.nbytes)
+    return y
+
+
+def snapshot():
+    """
+    :return: dict mapping key to [calls, seconds, bytes], e.g. to send the counters of a worker to the parent
+    """
+    return {key: list(counter) for key, counter in _counters.items()}
+
+
+def merge(counters):
+    for key, (calls, seconds, n_bytes) in counters.items():
+        counter = _counters.setdefault(key, [0, 0.0, 0])
+        counter[0] += calls
+        counter[1] += seconds
+        counter[2] += n_bytes
+
+
+def report():
+    """
+    prints the counters recorded since the last reset sorted by cumulative wall time, times of worker processes
+    are summed
+    """
+    print("[INFO] {:<40} {:>10} {:>10} {:>10}".format("Profile", "Calls", "Seconds", "MB/s"))
+    for key, (calls, seconds, n_bytes) in sorted(_counters.items(), key=lambda item: -item[1][1]):
+        print("[INFO] {:<40} {:>10} {:>10.3f} {:>10.1f}".format(
+            key, calls, seconds, n_bytes / 1e6 / max(seconds, 1e-12)))
@@ -0,0 +1,187 @@
+import numpy as np
+from scipy.signal import lfilter, lfilter_zi, sosfilt, sosfilt_zi
+
+from processing.operations import get_aggregation
+
+
+class StreamingFIR:
+    """
+    Full convolution with a kernel, computed sample block by sample block. The last len(kernel) - 1 input samples
+    are kept as overlap for the next block.
+    """
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.reset()
+
+    def reset(self):
+        self.tail = np.zeros(len(self.kernel) - 1)
+
+    def push(self, samples):
+        if len(samples) == 0:
+            return np.zeros(0)
+        buffer = np.concatenate([self.tail, samples])
+        y = np.convolve(buffer, self.kernel, mode="valid")
+        self.tail = buffer[len(buffer) - len(self.tail):]
+        return y
+
+    def flush(self):
+        """
+        :return: the trailing len(kernel) - 1 samples of the full convolution, resets the state
+        """
+        y = self.push(np.zeros(len(self.kernel) - 1))
+        self.reset()
+        return y
+
+
+class StreamingIIR:
+    """
+    Band-pass filter (b, a coefficients or second-order sections), the filter state is kept between blocks
+    """
+    def __init__(self, design):
+        self.design = design
+        self.reset()
+
+    def reset(self):
+        if isinstance(self.design, tuple):
+            self.zi = lfilter_zi(*self.design) * 0
+        else:
+            self.zi = sosfilt_zi(self.design) * 0
+
+    def push(self, samples):
+        if len(samples) == 0:
+            return np.zeros(0)
+        if isinstance(self.design, tuple):
+            b, a = self.design
+            y, self.zi = lfilter(b, a, samples, zi=self.zi)
+        else:
+            y, self.zi = sosfilt(self.design, samples, zi=self.zi)
+        return y
+
+    def flush(self):
+        self.reset()
+        return np.zeros(0)
+
+
+def streaming_operation(op):
+    """
+    :param op: Operation or FusedOperation of a compiled pipe
+    :return: StreamingFIR or StreamingIIR computing the same output block by block
+    """
+    if isinstance(op.design, np.ndarray) and op.design.ndim == 1:
+        return StreamingFIR(op.design)
+    if isinstance(op.design, (tuple, np.ndarray)):
+        return StreamingIIR(op.design)
+    raise ValueError("{} has no streaming implementation".format(op))
+
+
+class RunningAggregator:
+    """
+    Aggregations with constant memory accumulators: RMS (sum of squares), STD (Welford) and MAX
+    """
+    aggregation_ids = ["RMS", "STD", "MAX"]
+
+    def __init__(self, aggregation_id):
+        if aggregation_id not in self.aggregation_ids:
+            raise ValueError(
+                "{} can not be computed with constant memory, use a window".format(aggregation_id))
+        self.aggregation_id = aggregation_id
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.square_sum = 0.0
+        self.max = -np.inf
+
+    def update(self, samples):
+        if len(samples) == 0:
+            return
+        n = len(samples)
+        mean = np.mean(samples)
+        m2 = np.sum(np.square(samples - mean))
+        # combination of the running and the block moments (Chan et al.)
+        delta = mean - self.mean
+        total = self.n + n
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+        self.square_sum += np.sum(np.square(samples))
+        self.max = max(self.max, np.max(samples))
+
+    def value(self):
+        if self.n == 0:
+            return np.nan  # empty segment, as the batch aggregations
+        if self.aggregation_id == "RMS":
+            return np.sqrt(self.square_sum / self.n)
+        if self.aggregation_id == "STD":
+            return np.sqrt(self.m2 / self.n)
+        return self.max
+
+
+class WindowAggregator:
+    """
+    Any aggregation over the last window samples
+    """
+    def __init__(self, aggregation_id, window):
+        self.aggregation = get_aggregation(aggregation_id)
+        self.window = window
+        self.buffer = np.zeros(0)
+
+    def update(self, samples):
+        self.buffer = np.concatenate([self.buffer, samples])[-self.window:]
+
+    def value(self):
+        if len(self.buffer) == 0:
+            return np.nan
+        return self.aggregation(self.buffer)
+
+
+class RealtimeEstimator:
+    """
+    Computes an ASPP on a live signal stream. Samples are pushed in blocks of any size, the filters keep their state
+    between blocks and the aggregation is accumulated, so the memory needed per stream is constant. A segment ends
+    with end_segment or when the pushed distance reaches segment_length and yields the same value as
+    AccelerometerSignalProcessingPipeline.process_signal on the whole segment.
+    """
+    def __init__(self, aspp, segment_length=None, window=None):
+        """
+        :param aspp: AccelerometerSignalProcessingPipeline
+        :param segment_length: distance after which a segment ends automatically, None to end segments manually
+        :param window: if set, the aggregation is computed over the last window filtered samples of the segment,
+        which is needed for the aggregations without a constant memory accumulator
+        """
+        self.aspp = aspp
+        self.segment_length = segment_length
+        self.window = window
+        self.operations = [streaming_operation(op) for op in aspp.compiled_pipe]
+        self.reset()
+
+    def reset(self):
+        for op in self.operations:
+            op.reset()
+        if self.window is None:
+            self.aggregator = RunningAggregator(self.aspp.aggregation_id)
+        else:
+            self.aggregator = WindowAggregator(self.aspp.aggregation_id, self.window)
+        self.distance = 0.0
+
+    def push(self, samples, distance=0.0):
+        """
+        :param samples: block of raw accelerometer samples
+        :param distance: distance travelled during the block
+        :return: list with the value of the segment if the block completed one, otherwise an empty list
+        """
+        for op in self.operations:
+            samples = op.push(samples)
+        self.aggregator.update(samples)
+        self.distance += distance
+        if self.segment_length is not None and self.distance >= self.segment_length:
+            return [self.end_segment()]
+        return []
+
+    def end_segment(self):
+        samples = np.zeros(0)
+        for op in self.operations:
+            samples = np.concatenate([op.push(samples), op.flush()])
+        self.aggregator.update(samples)
+        value = self.aggregator.value()
+        self.reset()
+        return value
@@ -0,0 +1,189 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+from processing.operations import Operation, get_batch_aggregation
+from processing.processing_pipeline import AccelerometerSignalProcessingPipeline, compute_aspp_matrix
+from util.score import FeatureScorer
+
+
+def stratified_segment_order(df, seed=0):
+    """
+    shuffles the segment ids within each ZEB grade, so that the first n percent of every grade form a
+    stratified sample and larger samples contain the smaller ones
+    :return: list of (segment ids of one grade in random order)
+    """
+    rng = np.random.default_rng(seed)
+    segment_grades = df.groupby("segment_id")["ZWAUN_15"].mean()
+    strata = []
+    for _, grade_segments in segment_grades.groupby(np.round(segment_grades)):
+        strata.append(rng.permutation(np.asarray(grade_segments.index)))
+    return strata
+
+
+def sample_rows(df, strata, fraction):
+    segments = []
+    for stratum in strata:
+        segments += list(stratum[:int(np.ceil(len(stratum) * fraction))])
+    return np.flatnonzero(df["segment_id"].isin(segments))
+
+
+def score_aspp_list(list_of_aspp, df, signals, **compute_kwargs):
+    features = compute_aspp_matrix(list_of_aspp, signals, **compute_kwargs)
+    return FeatureScorer(df).score(features, features.aspp_ids)
+
+
+class SuccessiveHalvingSearch:
+    """
+    Scores all candidate ASPPs on a stratified sample of the segments and re-evaluates only the best
+    keep_ratio of them on a sample that is 1 / keep_ratio times larger, until the full data set is used.
+    """
+    def __init__(self, list_of_aspp, budget=0.1, keep_ratio=0.25, seed=0, min_candidates=1, **compute_kwargs):
+        """
+        :param list_of_aspp: candidate ASPPs
+        :param budget: fraction of the segments used in the first round
+        :param keep_ratio: fraction of the candidates kept after every round
+        :param seed: seed of the segment sampling
+        :param min_candidates: the search stops early when no more candidates than this are left
+        :param compute_kwargs: passed to compute_aspp_matrix, e.g. share_prefixes or cache
+        """
+        if not 0 < budget <= 1:
+            raise ValueError("budget must be in (0, 1], got {}".format(budget))
+        if not 0 < keep_ratio < 1:
+            raise ValueError("keep_ratio must be in (0, 1), got {}".format(keep_ratio))
+        self.list_of_aspp = list_of_aspp
+        self.budget = budget
+        self.keep_ratio = keep_ratio
+        self.seed = seed
+        self.min_candidates = min_candidates
+        self.compute_kwargs = compute_kwargs
+
+    def run(self, df, signals):
+        """
+        :param df: data frame with the metadata needed for scoring
+        :param signals: SignalStore aligned with df
+        :return: data frame with the scores of every candidate from the last round it took part in,
+        ranked by that round and its overall score
+        """
+        strata = stratified_segment_order(df[df["source"] == "ZEB"], seed=self.seed)
+        candidates = self.list_of_aspp
+        fraction = self.budget
+        rounds = []
+        while True:
+            rows = sample_rows(df, strata, fraction)
+            print("[INFO] Successive Halving: {} ASPPs on {} rows".format(len(candidates), len(rows)))
+            scores = score_aspp_list(candidates, df.iloc[rows], signals.take(rows), **self.compute_kwargs)
+            scores["round"] = len(rounds)
+            scores["fraction"] = fraction
+            rounds.append(scores)
+            if fraction >= 1 or len(candidates) <= self.min_candidates:
+                break
+
+            n_keep = max(self.min_candidates, int(np.ceil(len(candidates) * self.keep_ratio)))
+            best = set(scores.sort_values("overall", ascending=False, na_position="last")["feature"][:n_keep])
+            candidates = [aspp for aspp in candidates if str(aspp) in best]
+            next_fraction = min(fraction / self.keep_ratio, 1)
+            if len(candidates) == len(scores):
+                # the samples are nested, a round on as many rows with the same candidates would repeat this one
+                while next_fraction < 1 and len(sample_rows(df, strata, next_fraction)) == len(rows):
+                    next_fraction = min(next_fraction / self.keep_ratio, 1)
+                if len(sample_rows(df, strata, next_fraction)) == len(rows):
+                    break
+            fraction = next_fraction
+
+        ranked = pd.concat(rounds).drop_duplicates("feature", keep="last")
+        ranked = ranked.sort_values(["round", "overall"], ascending=False, na_position="last")
+        return ranked.reset_index(drop=True)
+
+
+def aggregate_store(signals, aggregation_ids, batch_size=512):
+    """
+    :return: rows x aggregations array with every aggregation of every signal
+    """
+    y = np.zeros((len(signals), len(aggregation_ids)), dtype=np.float32)
+    for start in range(0, len(signals), batch_size):
+        padded, lengths = signals.to_padded(start, start + batch_size)
+        for i, aggregation_id in enumerate(aggregation_ids):
+            y[start:start + len(lengths), i] = get_batch_aggregation(aggregation_id)(padded, lengths)
+    return y
+
+
+class BeamSearch:
+    """
+    Grows ASPPs one operation at a time and extends only the beam_width best prefixes with every operation.
+    A prefix is scored by its best ASPP over all aggregations. The filtered signals of the prefixes in the beam
+    are kept, so extending a prefix only computes the new operation. Besides the current beam at most beam_width + 1
+    filtered copies of the data set are held while the next level is scored.
+    """
+    def __init__(self, operations_to_consider, aggregations_to_consider, beam_width=10, max_complexity=4,
+                 batch_size=512):
+        self.operations_to_consider = operations_to_consider
+        self.aggregations_to_consider = aggregations_to_consider
+        self.beam_width = beam_width
+        self.max_complexity = max_complexity
+        self.batch_size = batch_size
+        self.examined = []
+
+    def prefix_id(self, operation_ids):
+        canonical_id = AccelerometerSignalProcessingPipeline(operation_ids, "RMS").canonical_id()
+        return canonical_id[:-len("-RMS")]
+
+    def score_prefix(self, scorer, operation_ids, filtered):
+        """
+        :return: score table of the ASPPs of the prefix with every aggregation and the best overall score
+        """
+        features = aggregate_store(filtered, self.aggregations_to_consider, self.batch_size)
+        aspp_ids = [str(AccelerometerSignalProcessingPipeline(operation_ids, aggregation_id))
+                    for aggregation_id in self.aggregations_to_consider]
+        self.examined += aspp_ids
+        scores = scorer.score(features, aspp_ids)
+        return scores, np.nan_to_num(np.asarray(scores["overall"]), nan=-np.inf).max()
+
+    def run(self, df, signals):
+        """
+        :param df: data frame with the metadata needed for scoring
+        :param signals: SignalStore aligned with df
+        :return: data frame with the scores of all examined ASPPs, ranked by overall score,
+        self.examined lists the examined ASPPs in the order of evaluation
+        """
+        scorer = FeatureScorer(df)
+        self.examined = []
+        seen = set()
+        beam = [([], signals)]
+        list_of_scores = []
+        for complexity in range(self.max_complexity + 1):
+            if complexity == 0:
+                candidates = beam
+            else:
+                candidates = [
+                    (operation_ids + [op_id], filtered)
+                    for operation_ids, filtered in beam for op_id in self.operations_to_consider
+                ]
+            # every prefix is scored as soon as it is filtered and only the signals of the best beam_width
+            # prefixes are kept, in a heap of (score, -order) where the root is the first prefix to drop
+            heap = []
+            n_prefixes = 0
+            for operation_ids, filtered in candidates:
+                if complexity > 0:
+                    if self.prefix_id(operation_ids) in seen:
+                        continue
+                    seen.add(self.prefix_id(operation_ids))
+                    filtered = filtered.apply(Operation(operation_ids[-1]), self.batch_size)
+                scores, best = self.score_prefix(scorer, operation_ids, filtered)
+                scores["complexity"] = complexity
+                list_of_scores.append(scores)
+                entry = (best, -n_prefixes, operation_ids, filtered)
+                n_prefixes += 1
+                if len(heap) < self.beam_width:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+            if n_prefixes == 0:
+                break
+            print("[INFO] Beam Search: {} prefixes with {} operations".format(n_prefixes, complexity))
+            heap.sort(key=lambda e: (-e[0], -e[1]))
+            beam = [(operation_ids, filtered) for _, _, operation_ids, filtered in heap]
+
+        ranked = pd.concat(list_of_scores)
+        ranked = ranked.sort_values("overall", ascending=False, na_position="last")
+        return ranked.reset_index(drop=True)
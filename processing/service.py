@@ -0,0 +1,157 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from processing.signal_store import SignalStore
+
+
+_worker = {}
+
+
+def init_worker(list_of_aspp):
+    _worker["list_of_aspp"] = list_of_aspp
+
+
+def process_batch(signals):
+    """
+    computes all ASPPs of the worker for a batch of segments with the batched pipeline
+    :return: segments x ASPPs float32 array
+    """
+    padded, lengths = SignalStore.from_signals(signals).to_padded()
+    values = [aspp.process_batch(padded, lengths) for aspp in _worker["list_of_aspp"]]
+    return np.column_stack(values).astype(np.float32)
+
+
+class IngestionService:
+    """
+    Accepts segments of many concurrent streams and computes a list of ASPPs for them. Segments of all streams are
+    collected into micro batches (up to max_batch_size segments or max_delay seconds), which are processed in a
+    process pool. Submitting blocks while max_pending segments are waiting (back-pressure) and next_result returns
+    the results of a stream in the order its segments were submitted.
+    """
+    def __init__(self, list_of_aspp, max_batch_size=256, max_delay=0.05, max_pending=4096, max_in_flight=4,
+                 processes=None):
+        self.list_of_aspp = list_of_aspp
+        self.aspp_ids = [str(aspp) for aspp in list_of_aspp]
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.processes = processes
+        self.pending = {}
+        self.batch_sizes = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.running = set()
+        self.pool = ProcessPoolExecutor(self.processes, initializer=init_worker, initargs=(self.list_of_aspp,))
+        self.batcher = asyncio.create_task(self.batch_loop())
+
+    async def stop(self):
+        await self.queue.put(None)
+        await self.batcher
+        if len(self.running) > 0:
+            await asyncio.gather(*self.running)
+        self.pool.shutdown()
+
+    async def submit(self, stream_id, signal):
+        """
+        :return: future of the float32 array with one value per ASPP
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(stream_id, deque()).append(future)
+        await self.queue.put((signal, future))
+        return future
+
+    async def next_result(self, stream_id):
+        """
+        :return: result of the oldest segment of the stream which was not returned yet
+        """
+        return await self.pending[stream_id].popleft()
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        stopped = False
+        while not stopped:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self.run_batch(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run_batch(self, batch):
+        try:
+            signals = [signal for signal, _ in batch]
+            self.batch_sizes.append(len(signals))
+            values = await asyncio.get_running_loop().run_in_executor(self.pool, process_batch, signals)
+            for (_, future), row in zip(batch, values):
+                future.set_result(row)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.in_flight.release()
+
+
+class ReplaySource:
+    """
+    Local stand-in for vehicle uploads: plays back a data set with one stream per (car, phone) setup. Every segment
+    is submitted once it would have been recorded at the sampling rate fs, divided by speed (speed=None replays
+    as fast as possible).
+    """
+    def __init__(self, df, signals, speed=1.0, fs=100, stream_keys=("car", "phone")):
+        self.streams = {}
+        for stream_id, grp in df.reset_index(drop=True).groupby(list(stream_keys)):
+            self.streams[stream_id] = [signals[i] for i in grp.index]
+        self.speed = speed
+        self.fs = fs
+        self.latencies = []
+
+    async def play_stream(self, service, stream_id):
+        submitted = deque()
+        for signal in self.streams[stream_id]:
+            if self.speed is not None:
+                await asyncio.sleep(len(signal) / self.fs / self.speed)
+            submitted.append(time.perf_counter())
+            await service.submit(stream_id, signal)
+        while len(submitted) > 0:
+            await service.next_result(stream_id)
+            self.latencies.append(time.perf_counter() - submitted.popleft())
+
+    async def play(self, service):
+        """
+        replays all streams concurrently into a started service
+        :return: dict with the throughput in segments per second and latency percentiles in seconds
+        """
+        start = time.perf_counter()
+        await asyncio.gather(*[self.play_stream(service, stream_id) for stream_id in self.streams])
+        duration = time.perf_counter() - start
+        return {
+            "segments": len(self.latencies),
+            "duration": duration,
+            "segments_per_second": len(self.latencies) / duration,
+            "latency_p50": float(np.percentile(self.latencies, 50)),
+            "latency_p95": float(np.percentile(self.latencies, 95)),
+            "mean_batch_size": float(np.mean(service.batch_sizes)),
+        }
@@ -0,0 +1,77 @@
+import os
+import hashlib
+
+from processing.feature_matrix import FeatureMatrix
+
+
+def shard_key(aspp):
+    return int(hashlib.sha1(aspp.canonical_id().encode()).hexdigest(), 16)
+
+
+def select_shard(list_of_aspp, shard_index, n_shards, by="index"):
+    """
+    deterministically selects the ASPPs of one shard, the same list is split the same way on every node
+    :param by: "index" takes every n_shards-th ASPP, "hash" uses the hash of the canonical id, which keeps
+    equivalent ASPPs in the same shard
+    """
+    if not 0 <= shard_index < n_shards:
+        raise ValueError("Shard {} does not exist for {} shards".format(shard_index, n_shards))
+    if by == "index":
+        return list_of_aspp[shard_index::n_shards]
+    if by == "hash":
+        return [aspp for aspp in list_of_aspp if shard_key(aspp) % n_shards == shard_index]
+    raise ValueError("Unknown sharding: {}".format(by))
+
+
+def grid_fingerprint(list_of_aspp):
+    return hashlib.sha1("\n".join([str(aspp) for aspp in list_of_aspp]).encode()).hexdigest()
+
+
+def shard_file_name(path, shard_index, n_shards):
+    return os.path.join(path, "shard-{:04d}-of-{:04d}.npz".format(shard_index, n_shards))
+
+
+def save_shard(path, features, shard_index, n_shards, by, fingerprint, data_set_hash):
+    """
+    writes the features of a shard with everything needed to validate it when the shards are merged
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    header = {
+        "shard_index": shard_index, "n_shards": n_shards, "by": by,
+        "fingerprint": fingerprint, "data_set_hash": data_set_hash,
+    }
+    features.save(shard_file_name(path, shard_index, n_shards), header)
+
+
+def merge_shards(path, list_of_aspp, data_set_hash):
+    """
+    validates that the shards in path belong to the grid and data set and cover every ASPP exactly once
+    :return: FeatureMatrix of the whole grid
+    """
+    fingerprint = grid_fingerprint(list_of_aspp)
+    file_names = sorted([f for f in os.listdir(path) if f.startswith("shard-") and f.endswith(".npz")])
+    shards = {}
+    for f in file_names:
+        features, header = FeatureMatrix.load(os.path.join(path, f))
+        if header["fingerprint"] != fingerprint or header["data_set_hash"] != data_set_hash:
+            print("[INFO] Skipping {}, it belongs to another grid or data set".format(f))
+            continue
+        shards[header["shard_index"], header["n_shards"], header["by"]] = features
+    if len(shards) == 0:
+        raise ValueError("No shards of this grid and data set found in {}".format(path))
+
+    partitions = set([(n_shards, by) for _, n_shards, by in shards])
+    if len(partitions) > 1:
+        raise ValueError("Shards of different partitions found: {}".format(sorted(partitions)))
+    n_shards, by = partitions.pop()
+    missing = [i for i in range(n_shards) if (i, n_shards, by) not in shards]
+    if len(missing) > 0:
+        raise ValueError("Missing shards {} of {}".format(missing, n_shards))
+
+    features = FeatureMatrix.merge([shards[i, n_shards, by] for i in range(n_shards)])
+    expected = set([str(aspp) for aspp in list_of_aspp])
+    if set(features.aspp_ids) != expected or len(features.aspp_ids) != len(expected):
+        raise ValueError("Shards do not cover the grid exactly once")
+    print("[INFO] Merged {} shards with {} ASPPs".format(n_shards, len(features.aspp_ids)))
+    return features
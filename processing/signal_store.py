@@ -0,0 +1,97 @@
+import time
+import hashlib
+import numpy as np
+
+from processing import profiling
+from processing.operations import pad_signals, unpad_signals, decode_signals
+
+
+class SignalStore:
+    """
+    Decoded accelerometer signals of a data set, stored as one contiguous float32 buffer
+    with the signal of row i located at values[offsets[i]:offsets[i + 1]]
+    """
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_df(cls, df, column="raw_accelerometer_signal"):
+        start = time.perf_counter()
+        values, offsets = decode_signals(list(df[column]))
+        if profiling.ENABLED:
+            profiling.record("decode_signals", start, values.nbytes)
+        return cls(values, offsets)
+
+    @classmethod
+    def from_signals(cls, signals):
+        offsets = np.zeros(len(signals) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(signal) for signal in signals])
+        if len(signals) == 0:
+            values = np.zeros(0, dtype=np.float32)
+        else:
+            values = np.concatenate(signals).astype(np.float32, copy=False)
+        return cls(values, offsets)
+
+    @classmethod
+    def from_padded(cls, padded, lengths):
+        values, offsets = unpad_signals(padded, lengths)
+        return cls(values.astype(np.float32, copy=False), offsets)
+
+    def to_padded(self, start=0, stop=None):
+        """
+        :return: zero padded 2-D array with one signal per row and the signal lengths
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        return pad_signals(self.values, self.offsets[start:stop + 1])
+
+    def take(self, rows):
+        """
+        :return: SignalStore with the signals of the given rows
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.lengths[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        positions = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return SignalStore(np.asarray(self.values[positions], dtype=np.float32), offsets)
+
+    def apply(self, operation, batch_size=512):
+        """
+        :param operation: Operation or FusedOperation
+        :return: SignalStore with every signal processed by the operation, computed in batches
+        """
+        signals = []
+        for start in range(0, len(self), batch_size):
+            padded, lengths = operation.compute_batch(*self.to_padded(start, start + batch_size))
+            values, offsets = unpad_signals(padded, lengths)
+            signals += np.split(values, offsets[1:-1])
+        return SignalStore.from_signals(signals)
+
+    def content_hash(self):
+        if getattr(self, "_content_hash", None) is None:
+            content = hashlib.sha1()
+            content.update(np.ascontiguousarray(self.offsets, dtype=np.int64).tobytes())
+            content.update(np.ascontiguousarray(self.values, dtype=np.float32).tobytes())
+            self._content_hash = content.hexdigest()
+        return self._content_hash
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def as_signal_store(signals):
+    if isinstance(signals, SignalStore):
+        return signals
+    return SignalStore.from_df(signals)
@@ -0,0 +1,49 @@
+import asyncio
+import argparse
+
+from processing.processing_pipeline import AccelerometerSignalProcessingPipeline
+from processing.service import IngestionService, ReplaySource
+from util.data_set import load_data_set
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replays a data set through the ingestion service")
+    parser.add_argument(
+        "--data", default="./data/zeb_data_set.csv", help="csv file or directory of a binary data set")
+    parser.add_argument(
+        "--speed", type=float, default=0, help="replay speed relative to real time, 0 replays as fast as possible")
+    parser.add_argument("--max_batch_size", type=int, default=256)
+    parser.add_argument("--max_delay", type=float, default=0.05, help="maximum wait for a batch in seconds")
+    parser.add_argument("--processes", type=int, default=None)
+    return parser.parse_args()
+
+
+async def replay(args, df, signals):
+    aspp_list = [
+        AccelerometerSignalProcessingPipeline([], "RMS"),
+        AccelerometerSignalProcessingPipeline(["avg-5"], "STD"),
+        AccelerometerSignalProcessingPipeline(["avg-3", "avg-3"], "RMS"),
+    ]
+    service = IngestionService(
+        aspp_list, max_batch_size=args.max_batch_size, max_delay=args.max_delay, processes=args.processes)
+    source = ReplaySource(df, signals, speed=args.speed if args.speed > 0 else None)
+    await service.start()
+    try:
+        stats = await source.play(service)
+    finally:
+        await service.stop()
+    return stats
+
+
+def main(args):
+    df, signals = load_data_set(args.data)
+    stats = asyncio.run(replay(args, df, signals))
+    print("[INFO]: {} segments of {} streams in {:.2f}s".format(
+        stats["segments"], len(df.groupby(["car", "phone"])), stats["duration"]))
+    print("[INFO]: {:.1f} segments/s, mean batch size {:.1f}".format(
+        stats["segments_per_second"], stats["mean_batch_size"]))
+    print("[INFO]: latency p50 {:.4f}s, p95 {:.4f}s".format(stats["latency_p50"], stats["latency_p95"]))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,6 +1,12 @@
 
 import os
+import json
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
+import matplotlib
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,6 +14,11 @@ import numpy as np
 from scipy.stats import pearsonr
 
 
+# increase when a change of the shared plot style or helpers changes the figures, changes of a plot function itself
+# are detected from its source
+PLOT_VERSION = 1
+
+
 def plot_feature(df, feature, path, count):
     zeb_df = df[df["source"] == "ZEB"]
     pearson_zwaun, _ = pearsonr(zeb_df[feature], zeb_df["ZWAUN_15"])
@@ -64,51 +75,52 @@ def plot_parameters(feature_df, result_path, ident_key, param_name, title):
     plt.close()
 
 
-def plots_for_papers(aspp_df_df, df, result_path):
-    df = df[df["source"] == "ZEB"]
+PAPER_ASPP_IDS = ["raw-RMS", "avg5-STD", "avg3avg3-RMS"]
+
+
+def prepare_paper_frame(df):
+    """
+    filters and labels the ZEB rows once for all paper figures
+    """
+    df = df[df["source"] == "ZEB"].copy()
     df["Vehicle"] = df["car"]
     df["iPhone"] = df["phone"]
     df["ZEB Grade"] = np.round(df["ZWAUN_15"]).astype(np.int32)
     df = df[df["vel [km/h]"] > 5]
     df = df[df["vel [km/h]"] < 75]
+    for aspp_id in PAPER_ASPP_IDS:
+        df["Unevenness Prediction ({})".format(aspp_id)] = df[aspp_id]
+    return df
 
-    print("Baseline")
-    for i, row in aspp_df_df.iterrows():
-        if "raw" in row["feature"]:
-            print("{} & {} & {} & {}\\\\".format(
-                row["feature"], round(row["grading"], 3), round(row["consistency"], 3), round(row["overall"], 3)))
 
+def plot_baseline(df, result_path):
     fig, axes = plt.subplots(1, 2, figsize=(8, 4))
-    df["Unevenness Prediction (raw-RMS)"] = df["raw-RMS"]
     sns.boxplot(data=df, x="vel [km/h] (r)", y="Unevenness Prediction (raw-RMS)", hue="ZEB Grade", ax=axes[0])
     sns.boxplot(data=df, x="Vehicle", y="Unevenness Prediction (raw-RMS)", hue="iPhone", ax=axes[1])
     plt.tight_layout()
     plt.savefig(os.path.join(result_path, "baseline.png"))
     plt.close()
 
+
+def plot_baseline_setup(df, result_path):
     sns.boxplot(data=df, x="iPhone", y="raw-RMS", hue="Vehicle")
     plt.savefig(os.path.join(result_path, "baseline-setup2.png"))
     plt.savefig(os.path.join(result_path, "baseline-setup2.eps"))
     plt.close()
 
-    fig, axes = plt.subplots(1, 2, figsize=(8, 4))
-    df["Unevenness Prediction (avg5-STD)"] = df["avg5-STD"]
-    sns.boxplot(data=df, x="vel [km/h] (r)", y="Unevenness Prediction (avg5-STD)", hue="ZEB Grade", ax=axes[0])
-    sns.boxplot(data=df, x="Vehicle", y="Unevenness Prediction (avg5-STD)", hue="iPhone", ax=axes[1])
-    plt.tight_layout()
-    plt.savefig(os.path.join(result_path, "aspp_1.png"))
-    plt.savefig(os.path.join(result_path, "aspp_1.eps"))
-    plt.close()
 
+def plot_aspp(df, result_path, aspp_id, file_name):
     fig, axes = plt.subplots(1, 2, figsize=(8, 4))
-    df["Unevenness Prediction (avg3avg3-RMS)"] = df["avg3avg3-RMS"]
-    sns.boxplot(data=df, x="vel [km/h] (r)", y="Unevenness Prediction (avg3avg3-RMS)", hue="ZEB Grade", ax=axes[0])
-    sns.boxplot(data=df, x="Vehicle", y="Unevenness Prediction (avg3avg3-RMS)", hue="iPhone", ax=axes[1])
+    y = "Unevenness Prediction ({})".format(aspp_id)
+    sns.boxplot(data=df, x="vel [km/h] (r)", y=y, hue="ZEB Grade", ax=axes[0])
+    sns.boxplot(data=df, x="Vehicle", y=y, hue="iPhone", ax=axes[1])
     plt.tight_layout()
-    plt.savefig(os.path.join(result_path, "aspp_2.png"))
-    plt.savefig(os.path.join(result_path, "aspp_2.eps"))
+    plt.savefig(os.path.join(result_path, "{}.png".format(file_name)))
+    plt.savefig(os.path.join(result_path, "{}.eps".format(file_name)))
     plt.close()
 
+
+def plot_setup_compared(df, result_path):
     fig, axes = plt.subplots(1, 3, figsize=(12, 4))
     sns.boxplot(data=df, x="Vehicle", y="Unevenness Prediction (raw-RMS)", hue="iPhone", ax=axes[0])
     axes[0].get_legend().remove()
@@ -120,6 +132,8 @@ def plots_for_papers(aspp_df_df, df, result_path):
     plt.savefig(os.path.join(result_path, "setup_compared.eps"))
     plt.close()
 
+
+def plot_grade_compared(df, result_path):
     fig, axes = plt.subplots(1, 3, figsize=(12, 4))
     sns.boxplot(data=df, x="vel [km/h] (r)", y="Unevenness Prediction (raw-RMS)", hue="ZEB Grade", ax=axes[0])
     sns.boxplot(data=df, x="vel [km/h] (r)", y="Unevenness Prediction (avg5-STD)", hue="ZEB Grade", ax=axes[1])
@@ -131,12 +145,87 @@ def plots_for_papers(aspp_df_df, df, result_path):
     plt.savefig(os.path.join(result_path, "grade_compared.eps"))
     plt.close()
 
-    plot_parameters(aspp_df_df, result_path, "avg", param_name="Kernel", title="Impact Moving Average Filter")
-    plot_parameters(aspp_df_df, result_path, "rmp", param_name="Kernel", title="Impact Ramp Filter")
 
-    print("ASPP 1")
-    for i, row in aspp_df_df.sort_values("overall", ascending=False)[:26].iterrows():
-        if "raw" in row["feature"]:
+def frame_hash(df):
+    h = hashlib.sha1(",".join([str(c) for c in df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def source_hash(function):
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        source = function.__qualname__
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def init_plot_worker():
+    matplotlib.use("Agg")
+
+
+def render_figure(function, df, result_path, kwargs):
+    # figures must not see style changes of figures rendered before them in the same worker
+    with matplotlib.rc_context():
+        function(df, result_path, **kwargs)
+
+
+def render_figures(figures, result_path, processes=None):
+    """
+    renders figures in a process pool, a figure is skipped if its inputs, the source of its function and
+    PLOT_VERSION did not change since the last run and its files still exist
+    :param figures: list of (function, data frame, keyword arguments, file names), function is called as
+    function(df, result_path, **kwargs) and writes the files
+    """
+    manifest_file = os.path.join(result_path, "plots.json")
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    to_render = []
+    for function, df, kwargs, file_names in figures:
+        key = ",".join(file_names)
+        figure_hash = hashlib.sha1("{}{}{}{}{}".format(
+            PLOT_VERSION, function.__name__, source_hash(function), sorted(kwargs.items()), frame_hash(df)).encode())
+        figure_hash = figure_hash.hexdigest()
+        exist = all([os.path.isfile(os.path.join(result_path, f)) for f in file_names])
+        if manifest.get(key) == figure_hash and exist:
             continue
-        print("{} & {} & {} & {}\\\\".format(
-            row["feature"], round(row["grading"], 3), round(row["consistency"], 3), round(row["overall"], 3)))
\ No newline at end of file
+        to_render.append((key, figure_hash, function, df, kwargs))
+    print("[INFO] Rendering {} of {} figures".format(len(to_render), len(figures)))
+    if len(to_render) == 0:
+        return
+
+    with ProcessPoolExecutor(processes, initializer=init_plot_worker) as executor:
+        futures = [executor.submit(render_figure, function, df, result_path, kwargs)
+                   for _, _, function, df, kwargs in to_render]
+        for (key, figure_hash, _, _, _), future in zip(to_render, futures):
+            future.result()
+            manifest[key] = figure_hash
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def plots_for_papers(aspp_df_df, df, result_path, processes=None):
+    df = prepare_paper_frame(df)
+    columns = ["vel [km/h] (r)", "Vehicle", "iPhone", "ZEB Grade"]
+    predictions = ["Unevenness Prediction ({})".format(aspp_id) for aspp_id in PAPER_ASPP_IDS]
+    figures = [
+        (plot_baseline, df[columns + predictions[:1]], {}, ["baseline.png"]),
+        (plot_baseline_setup, df[["iPhone", "Vehicle", "raw-RMS"]], {}, ["baseline-setup2.png", "baseline-setup2.eps"]),
+        (plot_aspp, df[columns + predictions[1:2]], {"aspp_id": "avg5-STD", "file_name": "aspp_1"},
+         ["aspp_1.png", "aspp_1.eps"]),
+        (plot_aspp, df[columns + predictions[2:]], {"aspp_id": "avg3avg3-RMS", "file_name": "aspp_2"},
+         ["aspp_2.png", "aspp_2.eps"]),
+        (plot_setup_compared, df[columns + predictions], {}, ["setup_compared.png", "setup_compared.eps"]),
+        (plot_grade_compared, df[columns + predictions], {}, ["grade_compared.png", "grade_compared.eps"]),
+    ]
+    scores = aspp_df_df[["feature", "grading", "consistency", "overall"]]
+    for ident_key, title in [("avg", "Impact Moving Average Filter"), ("rmp", "Impact Ramp Filter")]:
+        figures.append((
+            plot_parameters, scores[scores["feature"].str.startswith(ident_key)],
+            {"ident_key": ident_key, "param_name": "Kernel", "title": title},
+            ["moving_{}.png".format(ident_key), "moving_{}.eps".format(ident_key)]
+        ))
+    render_figures(figures, result_path, processes)
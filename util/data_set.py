@@ -0,0 +1,99 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+from processing.signal_store import SignalStore
+
+
+SIGNAL_COLUMN = "raw_accelerometer_signal"
+
+
+def save_binary_data_set(df, signals, path):
+    """
+    stores a data set as a directory with the metadata table (meta.csv) and the signals as a ragged
+    float32 array (values.f32 and offsets.i64), which can be loaded without parsing
+    :param df: data frame with the metadata, a signal column is dropped
+    :param signals: SignalStore with one signal per row of df
+    :param path: target directory
+    """
+    if len(df) != len(signals):
+        raise ValueError("Metadata has {} rows but there are {} signals".format(len(df), len(signals)))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    meta_df = df.drop(columns=[SIGNAL_COLUMN], errors="ignore")
+    meta_df.to_csv(os.path.join(path, "meta.csv"), index=False)
+    np.asarray(signals.values, dtype=np.float32).tofile(os.path.join(path, "values.f32"))
+    np.asarray(signals.offsets, dtype=np.int64).tofile(os.path.join(path, "offsets.i64"))
+    with open(os.path.join(path, "header.json"), "w") as f:
+        json.dump({"rows": len(signals), "values": int(signals.offsets[-1])}, f)
+
+
+def load_binary_data_set(path):
+    """
+    :return: metadata data frame and a SignalStore memory mapping the signal values
+    """
+    with open(os.path.join(path, "header.json")) as f:
+        header = json.load(f)
+    meta_df = pd.read_csv(os.path.join(path, "meta.csv"), float_precision="round_trip")
+    offsets = np.fromfile(os.path.join(path, "offsets.i64"), dtype=np.int64)
+    if header["values"] > 0:
+        values = np.memmap(os.path.join(path, "values.f32"), dtype=np.float32, mode="r", shape=(header["values"],))
+    else:
+        values = np.zeros(0, dtype=np.float32)
+    if len(offsets) != header["rows"] + 1 or len(meta_df) != header["rows"]:
+        raise ValueError("Data set at {} is incomplete".format(path))
+    return meta_df, SignalStore(values, offsets)
+
+
+def load_data_set(path):
+    """
+    loads a data set either from a csv file with comma separated signals or from a binary data set directory
+    :return: data frame and SignalStore
+    """
+    if os.path.isdir(path):
+        return load_binary_data_set(path)
+    df = pd.read_csv(path)
+    return df, SignalStore.from_df(df)
+
+
+def iterate_data_set(path, chunk_size):
+    """
+    reads a data set in chunks of rows, either from a csv file or from a binary data set directory
+    :return: generator of (data frame, SignalStore) pairs, each with at most chunk_size rows
+    """
+    if not os.path.isdir(path):
+        for df in pd.read_csv(path, chunksize=chunk_size):
+            yield df.reset_index(drop=True), SignalStore.from_df(df)
+        return
+
+    with open(os.path.join(path, "header.json")) as f:
+        header = json.load(f)
+    offsets = np.fromfile(os.path.join(path, "offsets.i64"), dtype=np.int64)
+    values = np.memmap(
+        os.path.join(path, "values.f32"), dtype=np.float32, mode="r", shape=(max(header["values"], 1),))
+    start = 0
+    for meta_df in pd.read_csv(os.path.join(path, "meta.csv"), chunksize=chunk_size, float_precision="round_trip"):
+        stop = start + len(meta_df)
+        chunk_offsets = offsets[start:stop + 1]
+        chunk_values = np.array(values[chunk_offsets[0]:chunk_offsets[-1]])
+        yield meta_df.reset_index(drop=True), SignalStore(chunk_values, chunk_offsets - chunk_offsets[0])
+        start = stop
+
+
+def convert_csv_to_binary(csv_path, path):
+    df, signals = load_data_set(csv_path)
+    save_binary_data_set(df, signals, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts a csv data set to the binary data set format")
+    parser.add_argument("csv_path")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    convert_csv_to_binary(args.csv_path, args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,78 @@
 import pandas as pd
-from sklearn.metrics import classification_report, mean_absolute_error, accuracy_score
 from scipy.stats import pearsonr
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
 
+from processing.feature_matrix import FeatureMatrix
+
+
+# stored scores are only reused if they were computed with the same version, increase it when the scores change
+SCORE_VERSION = 1
 
-def filter_for_common_segment_ids(df):
-    possible_segment_ids = np.arange(df["segment_id"].max())
 
-    segments_collected = possible_segment_ids
+def filter_for_common_segment_ids(df):
+    # segment ids below the largest id, which were recorded by every (car, phone) setup
+    segments_collected = set(np.arange(df["segment_id"].max()).tolist())
     for val, val_grp in df.groupby(["car", "phone"]):
-        filtered_segments = []
-        val_segments = np.array(val_grp["segment_id"])
-        for s in possible_segment_ids:
-            if s in segments_collected and s in val_segments:
-                filtered_segments.append(s)
-        segments_collected = np.array(filtered_segments)
-
-    df = df[df["segment_id"].isin(segments_collected)]
+        segments_collected &= set(val_grp["segment_id"].tolist())
+
+    df = df[df["segment_id"].isin(list(segments_collected))]
     return df
 
 
+def split_by_group(df, keys, values):
+    """
+    :return: list with the entries of values belonging to each group of df.groupby(keys), in group order
+    """
+    codes = df.groupby(keys, sort=True).ngroup().to_numpy()
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    order = order[codes >= 0]
+    codes = codes[codes >= 0]
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    return np.split(np.asarray(values)[order], bounds) if len(codes) > 0 else []
+
+
+def setup_statistics(groups):
+    """
+    :param groups: list of arrays with the feature values of every setup, either 1-D or rows x features
+    :return: setups x ... arrays of the means, maxima and minima
+    """
+    means = np.array([np.mean(values, axis=0) for values in groups])
+    maxs = np.array([np.max(values, axis=0) for values in groups])
+    mins = np.array([np.min(values, axis=0) for values in groups])
+    return means, maxs, mins
+
+
+def pairwise_setup_deviation(means, maxs, mins):
+    """
+    1 - mean absolute difference of the setup means over all pairs of setups, where each pair is normalized
+    by its joint value range. The deviation is symmetric, so every unordered pair is computed once. The pairs are
+    summed setup by setup, so the temporaries are (setups x features) and not (pairs x features).
+    :param means: setups x features array of feature means
+    :param maxs: setups x features array of feature maxima
+    :param mins: setups x features array of feature minima
+    :return: one score per feature
+    """
+    n_pairs = len(means) * (len(means) - 1) // 2
+    total = np.zeros(np.shape(means)[1:])
+    for i in range(len(means) - 1):
+        joint_range = np.maximum(maxs[i], maxs[i + 1:]) - np.minimum(mins[i], mins[i + 1:])
+        total += np.sum(np.abs(means[i + 1:] - means[i]) / joint_range, axis=0)
+    if n_pairs == 0:
+        return np.full(np.shape(means)[1:], np.nan)
+    return 1 - total / n_pairs
+
+
 def score_inter_setup_deviation_raw(df, feature_key):
-    features = {}
-    diffs = {}
-    for ident, grp in df.groupby("note"):
-        features[ident] = np.array(grp[feature_key])
-
-    for ident1 in features:
-        for ident2 in features:
-            if ident1 == ident2:
-                continue
-            vals_1, vals_2 = features[ident1], features[ident2]
-            max_val = np.max([np.max(vals_1), np.max(vals_2)])
-            min_val = np.min([np.min(vals_1), np.min(vals_2)])
-            vals_1_norm = (vals_1 - min_val) / (max_val - min_val)
-            vals_2_norm = (vals_2 - min_val) / (max_val - min_val)
-            diffs[f"{ident1}-{ident2}"] = np.abs(np.mean(vals_2_norm) - np.mean(vals_1_norm))
-    return 1 - np.mean([diffs[ident] for ident in diffs])
+    groups = split_by_group(df, "note", np.asarray(df[feature_key], dtype=np.float64))
+    return pairwise_setup_deviation(*setup_statistics(groups))
 
 
 def score_inter_setup_deviation(df, feature_key):
-    features = {}
-    diffs = {}
     df = df[df["source"] == "ZEB"]
     df = filter_for_common_segment_ids(df)
-    df = df.sort_values("segment_id", ascending=True)
-    for ident, grp in df.groupby(["car", "phone"]):
-        features[ident] = np.array(grp[feature_key])
-
-    for ident1 in features:
-        for ident2 in features:
-            if ident1 == ident2:
-                continue
-            vals_1, vals_2 = features[ident1], features[ident2]
-            max_val = np.max([np.max(vals_1), np.max(vals_2)])
-            min_val = np.min([np.min(vals_1), np.min(vals_2)])
-            vals_1_norm = (vals_1 - min_val) / (max_val - min_val)
-            vals_2_norm = (vals_2 - min_val) / (max_val - min_val)
-            diffs[f"{ident1}-{ident2}"] = np.abs(np.mean(vals_2_norm - vals_1_norm))
-    return 1 - np.mean([diffs[ident] for ident in diffs])
+    groups = split_by_group(df, ["car", "phone"], np.asarray(df[feature_key], dtype=np.float64))
+    return pairwise_setup_deviation(*setup_statistics(groups))
 
 
 def score_grade_capabilities(df, feature_key):
@@ -73,3 +85,64 @@ def score_grade_capabilities(df, feature_key):
             scores_by_vel.append(np.abs(pearson))
     return np.mean(scores_by_vel)
 
+
+
+def select_rows(features, rows):
+    if isinstance(features, FeatureMatrix):
+        return features.take_rows(rows)
+    return np.asarray(features[rows], dtype=np.float64)
+
+
+class FeatureScorer:
+    """
+    Scores many features at once with the same results as score_grade_capabilities and
+    score_inter_setup_deviation. The group structure (velocity bins, setups on common segments) is computed once
+    and every score is computed for all features with matrix operations.
+    """
+    def __init__(self, df):
+        meta_df = df[["source", "car", "phone", "segment_id", "vel [km/h] (r)", "ZWAUN_15"]].copy()
+        meta_df["row"] = np.arange(len(meta_df))
+        zeb_df = meta_df[meta_df["source"] == "ZEB"]
+
+        self.target = np.asarray(meta_df["ZWAUN_15"], dtype=np.float64)
+        self.velocity_bins = split_by_group(zeb_df, "vel [km/h] (r)", zeb_df["row"])
+        common_df = filter_for_common_segment_ids(zeb_df)
+        self.setups = split_by_group(common_df, ["car", "phone"], common_df["row"])
+
+    def score_grade_capabilities(self, features):
+        total = np.zeros(features.shape[1])
+        count = np.zeros(features.shape[1])
+        for rows in self.velocity_bins:
+            target = self.target[rows]
+            if len(np.unique(target)) < 2:
+                continue
+            x = select_rows(features, rows)
+            varies = np.any(x != x[0], axis=0)
+            x = x - np.mean(x, axis=0)
+            target = target - np.mean(target)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                pearson = (target @ x) / (np.linalg.norm(x, axis=0) * np.linalg.norm(target))
+            pearson = np.abs(np.clip(pearson, -1, 1))
+            total[varies] += pearson[varies]
+            count[varies] += 1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count
+
+    def score_inter_setup_deviation(self, features):
+        groups = [select_rows(features, rows) for rows in self.setups]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return pairwise_setup_deviation(*setup_statistics(groups))
+
+    def score(self, features, feature_ids):
+        """
+        :param features: rows x features array or FeatureMatrix aligned with the rows of the scored data frame
+        :param feature_ids: name of every feature column
+        :return: data frame with feature, grading, consistency and overall score
+        """
+        scores_df = pd.DataFrame({
+            "feature": feature_ids,
+            "grading": self.score_grade_capabilities(features),
+            "consistency": self.score_inter_setup_deviation(features),
+        })
+        scores_df["overall"] = (scores_df["grading"] + scores_df["consistency"]) / 2
+        return scores_df
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from processing.operations import encode_signal
+from util.data_set import SIGNAL_COLUMN
+
+
+WINDSHIELD_EXPERIMENTS = {
+    "Mounting Strength Test": ["Exp. 4 - Loose Mounting", "Exp. 4 - Tight Mounting"],
+    "Mounting Type Test": ["Exp. 5 - New Mounting", "Exp. 5 -Old Mounting"],
+    "Unevenness Test Position": ["Exp. 1 - Position-1", "Exp. 1 - Position-2"],
+    "Phone Type Test": ["Exp. 6 - Smartphone 13", "Exp. 6 - Smartphone XR"],
+    "Phone Type Test 2": ["Exp. 8 - iPhone 13 (no case)", "Exp. 8 - iPhone XR (no case)"],
+}
+
+
+def make_signal(rng, length, unevenness, fs=100):
+    """
+    accelerometer like signal: vibration of the car body, broadband road excitation scaled by the unevenness and noise
+    """
+    t = np.arange(length) / fs
+    body = np.sin(2 * np.pi * rng.uniform(1, 3) * t + rng.uniform(0, 2 * np.pi))
+    road = np.convolve(rng.normal(size=length), np.ones(3) / 3, mode="same") * unevenness
+    return (body + road + 0.1 * rng.normal(size=length)).astype(np.float32)
+
+
+def make_zeb_data_set(n_segments=100, cars=("A", "B"), phones=("X", "Y"), min_length=100, max_length=400,
+                      nan_ratio=0.02, seed=0):
+    """
+    synthetic data set with the columns of the ZEB data set, every setup records the same segments
+    :param nan_ratio: fraction of rows without a signal
+    :return: data frame with encoded signals
+    """
+    rng = np.random.default_rng(seed)
+    zwaun = rng.uniform(0, 6, n_segments)
+    velocity = rng.uniform(10, 90, n_segments)
+    rows = []
+    for car in cars:
+        for phone in phones:
+            for segment_id in range(n_segments):
+                length = int(rng.integers(min_length, max_length + 1))
+                signal = make_signal(rng, length, 1 + zwaun[segment_id])
+                rows.append({
+                    SIGNAL_COLUMN: encode_signal(signal) if rng.random() >= nan_ratio else np.nan,
+                    "ZWAUN_15": zwaun[segment_id],
+                    "AUN": zwaun[segment_id] * rng.uniform(0.8, 1.2),
+                    "setup": "{}-{}".format(car, phone),
+                    "car": car,
+                    "phone": phone,
+                    "segment_id": segment_id,
+                    "source": "ZEB",
+                    "vel [km/h]": velocity[segment_id],
+                    "vel [km/h] (r)": int(np.round(velocity[segment_id] / 20) * 20),
+                })
+    return pd.DataFrame(rows)
+
+
+def make_windshield_data_set(n_rows_per_note=50, min_length=100, max_length=400, nan_ratio=0.02, seed=0):
+    """
+    synthetic data set with the accounts and notes of the windshield data set
+    :return: data frame with encoded signals
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for account, notes in WINDSHIELD_EXPERIMENTS.items():
+        for i, note in enumerate(notes):
+            for _ in range(n_rows_per_note):
+                length = int(rng.integers(min_length, max_length + 1))
+                signal = make_signal(rng, length, 1 + 0.2 * i + rng.uniform(0, 2))
+                rows.append({
+                    SIGNAL_COLUMN: encode_signal(signal) if rng.random() >= nan_ratio else np.nan,
+                    "account": account,
+                    "note": note,
+                    "car": "A",
+                    "phone": "X" if i == 0 else "Y",
+                    "vel [km/h]": rng.uniform(30, 60),
+                })
+    return pd.DataFrame(rows)